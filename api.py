@@ -1,97 +1,294 @@
-from flask import Flask, jsonify, request
-from collections import deque
-from datetime import datetime
+if __name__ == '__main__':
+    # Entry point (Claude Desktop runs this file). startup.py answers the MCP
+    # handshake before the imports below are done: it imports this module
+    # as 'api' in the background.
+    import startup
+    startup.main()
+    raise SystemExit
+
+from flask import Flask, Response, abort, jsonify, make_response, request
+from flask.logging import default_handler
+from werkzeug.serving import run_simple
 import threading
-import sys
+import json
 import logging
-import base64
-import os
-import tempfile
-from io import BytesIO
-from PIL import Image
+from buddy_logging import get_logger
+from http_handlers import (INVALID_BATCH_ERROR, INVALID_LEASE_ERROR, INVALID_ROBOT_ERROR, MAX_POLL_WAIT, MISSING_BODY_ERROR, STREAM_HEARTBEAT,
+                           UNKNOWN_ROBOT_ERROR, UPLOAD_SUCCESS, StreamDeliveries, ack_result, decode_image_payload,
+                           poll_result, stream_event, valid_lease)
+import metrics
+import tracing
+from robots import UnknownRobotError
+from state_broker import create_registry
 
 app = Flask(__name__)
 
-# Path to save the latest image
-LATEST_IMAGE_PATH = os.path.join(os.path.dirname(__file__), "latest_image.png")
+# Flask logs go through buddy_logging to stderr (stdout is reserved for MCP JSON communication)
+app.logger.removeHandler(default_handler)
+logger = get_logger("api")
 
-# Target image size
-IMAGE_SIZE = (800, 600)
+# Queue gauges are read from the robots when /metrics is scraped
+metrics.Gauge("buddy_operation_queue_depth", "Operations waiting in a robot queue", ("robot",),
+              lambda: [((robot.id,), len(robot.operation_queue)) for robot in robots])
+metrics.Gauge("buddy_operations_in_flight", "Leased operations waiting for an acknowledgement", ("robot",),
+              lambda: [((robot.id,), robot.operation_queue.in_flight_count()) for robot in robots])
 
-# Redirect Flask logs to stderr (stdout is reserved for MCP JSON communication)
-app.logger.addHandler(logging.StreamHandler(sys.stderr))
-log = lambda msg: print(msg, file=sys.stderr)
+# Shared state between Flask and MCP server: one queue, lock and frame cache per robot.
+# Queues are journaled to SQLite when BUDDY_QUEUE_DB is set. In HTTP worker
+# processes (http_workers.py) this is a proxy to the MCP process's state.
+robots = create_registry()
 
-# Shared state between Flask and MCP server
-operation_queue = deque()
-latest_image = {"base64": None, "timestamp": None}
-queue_lock = threading.Lock()  # Lock to prevent race conditions between Flask and MCP threads
+
+def current_robot(create: bool = False):
+    """Robot addressed by the request (?robot=<id>, the default robot otherwise).
+    
+    Only the robot's own polls and uploads create it (create=True): other
+    endpoints answer 404 for unknown robots.
+    """
+    try:
+        return robots.get(request.args.get("robot"), create)
+    except ValueError:
+        abort(make_response(jsonify(INVALID_ROBOT_ERROR), 400))
+    except UnknownRobotError:
+        abort(make_response(jsonify(UNKNOWN_ROBOT_ERROR), 404))
 
 
 @app.route("/")
 def home():
     return "Bienvenue sur l'api Buddy!"
 
+@app.route("/robots", methods=['GET'])
+def list_robots():
+    """List known robots with their queue depth and latest frame version."""
+    return jsonify({"status": "success", "robots": robots.summaries()}), 200
+
+@app.route("/metrics", methods=['GET'])
+def metrics_endpoint():
+    """Counters and latency histograms in the Prometheus text format."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route("/trace/<op_id>", methods=['GET'])
+def get_trace(op_id):
+    """Stage timestamps and segment durations of one operation (see tracing.py)."""
+    trace = tracing.get_trace(op_id)
+    if trace is None:
+        return jsonify({
+            "error": "NotFound",
+            "message": f"Aucune trace pour l'opération '{op_id}'."
+        }), 404
+    return jsonify({"status": "success", "trace": trace}), 200
+
+@app.route("/trace/summary", methods=['GET'])
+def trace_summary():
+    """Rolling p50/p90/p99 of each trace segment over the recent operations."""
+    return jsonify({"status": "success", **tracing.summary()}), 200
+
 @app.route("/upload_image", methods=['POST'])
 def upload_image():
     # Get JSON payload from request
-    data = request.get_json()
+    image_bytes, error = decode_image_payload(request.get_json())
+    if error:
+        return jsonify(error), 400
     
-    if not data or 'image_base64' not in data:
-        return jsonify({
-            "error": "MissingParameter",
-            "message": "Le paramètre 'image' (base64) est requis."
-        }), 400
+    # Resize/encode happens on the image pipeline workers, not on this request thread
+    current_robot(create=True).image_pipeline.submit_frame(image_bytes)
     
-    image_base64 = data['image_base64']
+    return jsonify(UPLOAD_SUCCESS), 200
+
+@app.route("/upload_image/raw", methods=['POST'])
+def upload_image_raw():
+    """
+    Binary variant of /upload_image.
     
-    # Save image to file (overwrite latest), resized to 800x600
-    try:
-        image_bytes = base64.b64decode(image_base64)
-        img = Image.open(BytesIO(image_bytes))
-        img = img.resize(IMAGE_SIZE, Image.Resampling.LANCZOS)
-        img.save(LATEST_IMAGE_PATH, 'PNG')
-    except Exception as e:
-        log(f"Error saving image: {e}")
+    Accepts the encoded frame either as the raw request body
+    (Content-Type: application/octet-stream, image/jpeg, ...) or as a
+    multipart/form-data file field named 'image'. This skips the JSON parse
+    and base64 decode of /upload_image and sends 33% fewer bytes.
+    """
+    if request.mimetype == "multipart/form-data":
+        image_file = request.files.get("image")
+        image_bytes = image_file.read() if image_file else None
+    else:
+        image_bytes = request.get_data(cache=False)
     
-    # Store timestamp for MCP take_picture tool
-    latest_image["timestamp"] = datetime.now().isoformat()
+    if not image_bytes:
+        return jsonify(MISSING_BODY_ERROR), 400
     
-    return jsonify({
-        "status": "success",
-        "message": "Image reçue avec succès"
-    }), 200
+    current_robot(create=True).image_pipeline.submit_frame(image_bytes)
+    
+    return jsonify(UPLOAD_SUCCESS), 200
+
+@app.route("/frames", methods=['GET'])
+def frames():
+    """
+    List the frames kept in the history (metadata only, oldest first).
+    
+    Query parameters:
+    - since: only return frames with a sequence number greater than this
+    """
+    robot = current_robot()
+    since = request.args.get("since", default=0, type=int)
+    with robot.lock:
+        listed = [
+            {"seq": frame["seq"], "timestamp": frame["timestamp"],
+             "mime_type": frame["mime_type"], "size": len(frame["bytes"])}
+            for frame in robot.frame_history if frame["seq"] > since
+        ]
+        latest_seq = robot.latest_image["version"]
+    return jsonify({"status": "success", "latest": latest_seq, "frames": listed}), 200
+
+@app.route("/frames/<int:seq>", methods=['GET'])
+def frame_by_seq(seq):
+    """Return the encoded image of one frame from the history."""
+    robot = current_robot()
+    with robot.lock:
+        frame = next((frame for frame in robot.frame_history if frame["seq"] == seq), None)
+    if frame is None:
+        return jsonify({
+            "error": "NotFound",
+            "message": f"L'image #{seq} n'est plus dans l'historique."
+        }), 404
+    return Response(frame["bytes"], mimetype=frame["mime_type"])
+
+@app.route("/stream.mjpg", methods=['GET'])
+def stream_mjpeg():
+    """
+    Live MJPEG stream of the processed camera frames (open it in a browser or VLC).
+    
+    Frames are pushed as soon as the image pipeline publishes them. Viewers
+    that can't keep up skip frames instead of buffering them.
+    """
+    pipeline = current_robot().image_pipeline
+    
+    def parts():
+        for jpeg in pipeline.iter_stream_frames():
+            yield b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(jpeg)
+            yield jpeg
+            yield b"\r\n"
+    
+    return Response(parts(), mimetype="multipart/x-mixed-replace; boundary=frame", headers={
+        "Cache-Control": "no-cache",
+    })
 
 @app.route("/operation", methods=['GET'])
 def operation():
     """
     Get the next operation from the queue.
     This endpoint is polled by Buddy to get commands to execute.
+
+    Query parameters:
+    - wait: optional long-poll timeout in seconds (capped to MAX_POLL_WAIT).
+      When the queue is empty the request is parked until an operation is
+      queued or the timeout expires, instead of returning null immediately.
+    - max: optional batch size (>= 1). When given, up to `max` operations are drained
+      atomically and returned in queue order as {"operations": [...]} instead
+      of the single {"operation": ...} field.
+    - lease: optional visibility timeout in seconds. Returned operations must
+      be acknowledged via POST /operation/<id>/ack before it expires, otherwise
+      they are delivered again. Use each operation's "id" to avoid executing
+      a redelivered operation twice.
     """
-    # Log queue state for debugging
-    queue_id = id(operation_queue)
-    queue_size = len(operation_queue)
-    log(f"[/operation] Polled - Queue size: {queue_size} (Queue ID: {queue_id})")
+    wait = request.args.get("wait", default=0.0, type=float)
+    wait = max(0.0, min(wait, MAX_POLL_WAIT))
+    batch_size = request.args.get("max", type=int)
+    lease = request.args.get("lease", type=float)
+    if batch_size is not None and batch_size < 1:
+        return jsonify(INVALID_BATCH_ERROR), 400
+    if not valid_lease(lease):
+        return jsonify(INVALID_LEASE_ERROR), 400
+    robot = current_robot(create=True)
+    operation_queue = robot.operation_queue
     
-    if operation_queue:
-        with queue_lock:
-            op = operation_queue.popleft()
-        log(f"[/operation] Returning operation: {op}")
-        return jsonify({"status": "success", "operation": op}), 200
+    logger.debug("[/operation] Polled", extra={"robot": robot.id, "queue_size": len(operation_queue)})
     
-    log(f"[/operation] No operations in queue")
-    return jsonify({"status": "success", "operation": None}), 200
+    ops = operation_queue.pop(batch_size or 1, wait, lease)
+    
+    return jsonify(poll_result(robot, ops, batch_size)), 200
+
+@app.route("/operation/<op_id>/ack", methods=['POST'])
+def operation_ack(op_id):
+    """
+    Acknowledge a leased operation so it isn't delivered again.
+    
+    Optional JSON payload: {"duration": <execution time in seconds>}.
+    Acknowledging the same operation twice is harmless.
+    
+    Also the completion callback for tracing: robots polling without a lease
+    may call it when an operation is done, it then only completes the trace.
+    """
+    body, status = ack_result(current_robot(), op_id, request.get_json(silent=True))
+    return jsonify(body), status
+
+@app.route("/operation/stream", methods=['GET'])
+def operation_stream():
+    """
+    Push channel for operations (server-sent events).
+    
+    While Buddy keeps this connection open, every queued operation is popped
+    and sent as an `operation` event the moment it is appended, so no polling
+    is needed. When no robot is connected operations simply stay in the queue
+    and are picked up later by /operation.
+    
+    Pushed operations are leased (?lease=<seconds>, BUDDY_STREAM_LEASE by
+    default) and must be acknowledged like with /operation. Those still
+    unacknowledged when the connection closes go back to the queue.
+    """
+    lease = request.args.get("lease", type=float)
+    if not valid_lease(lease):
+        return jsonify(INVALID_LEASE_ERROR), 400
+    robot = current_robot(create=True)
+    deliveries = StreamDeliveries(robot, lease)
+    
+    def events():
+        logger.info("[/operation/stream] Robot %s connected", robot.id)
+        try:
+            while True:
+                ops = robot.operation_queue.pop(None, STREAM_HEARTBEAT, deliveries.lease)
+                
+                if not ops:
+                    # Keep-alive comment; also lets us notice a dropped connection
+                    yield ": keep-alive\n\n"
+                    continue
+                
+                for op in ops:
+                    deliveries.pushed(op)
+                    yield stream_event(robot, op)
+        finally:
+            deliveries.release()
+            logger.info("[/operation/stream] Robot %s disconnected", robot.id)
+    
+    return Response(events(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+def start_flask_thread(host='0.0.0.0', port=5000):
+    """Serve the API from a daemon thread.
+    
+    Uses werkzeug's run_simple() rather than app.run(), which prints the Flask
+    banner on stdout and would corrupt the MCP stdio stream. Werkzeug's own
+    startup and per-request messages go to the 'werkzeug' logger (ERROR only).
+    """
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    flask_thread = threading.Thread(
+        target=lambda: run_simple(host, port, app, threaded=True),
+        name="flask",
+        daemon=True
+    )
+    flask_thread.start()
+    logger.info("Flask server started on http://%s:%d", host, port)
+    return flask_thread
 
 def run_cli():
     """Run interactive CLI for controlling Buddy."""
-    import json
-    from buddy_functions import build_operation, LATEST_IMAGE_PATH
+    from buddy_functions import build_operation, build_script_operation, enqueue, script_store
     
     print("Buddy CLI - Type 'help' for commands, 'quit' to exit")
+    robot = robots.get()
     
     while True:
         try:
-            user_input = input("\nbuddy> ").strip()
+            user_input = input(f"\n{robot.id}> ").strip()
         except (EOFError, KeyboardInterrupt):
             print("\nGoodbye!")
             break
@@ -117,7 +314,10 @@ Commands:
   head <yes|no>               Nod (yes) or shake (no) head
   mood <mood>                 Set mood (happy, sad, angry, surprised, neutral, afraid, disgusted, contempt)
   picture                     Show latest picture info
+  stop                        Stop moving now (urgent, cancels queued movements)
+  script [name]               Run a stored script (no name: list stored scripts)
   queue                       Show current operation queue
+  robot [id]                  Switch to another robot (no id: list known robots)
   help                        Show this help
   quit                        Exit CLI
 """)
@@ -128,7 +328,7 @@ Commands:
                 continue
             try:
                 operation = build_operation("move_buddy", speed=float(args[0]), distance=float(args[1]))
-                operation_queue.append(operation)
+                enqueue(operation, robot.id)
                 print(f"Queued: {json.dumps(operation)}")
             except ValueError:
                 print("Error: speed and distance must be numbers")
@@ -139,7 +339,7 @@ Commands:
                 continue
             try:
                 operation = build_operation("rotate_buddy", speed=float(args[0]), angle=float(args[1]))
-                operation_queue.append(operation)
+                enqueue(operation, robot.id)
                 print(f"Queued: {json.dumps(operation)}")
             except ValueError:
                 print("Error: speed and angle must be numbers")
@@ -156,7 +356,7 @@ Commands:
                 message_parts = args[:-1]
             message = " ".join(message_parts)
             operation = build_operation("speak", message=message, volume=volume)
-            operation_queue.append(operation)
+            enqueue(operation, robot.id)
             print(f"Queued: {json.dumps(operation)}")
         
         elif cmd == "head":
@@ -164,7 +364,7 @@ Commands:
                 print("Usage: head <yes|no>")
                 continue
             operation = build_operation("move_head", axis=args[0].lower())
-            operation_queue.append(operation)
+            enqueue(operation, robot.id)
             print(f"Queued: {json.dumps(operation)}")
         
         elif cmd == "mood":
@@ -173,68 +373,59 @@ Commands:
                 print(f"Usage: mood <{' | '.join(valid_moods)}>")
                 continue
             operation = build_operation("set_mood", mood=args[0].lower())
-            operation_queue.append(operation)
+            enqueue(operation, robot.id)
             print(f"Queued: {json.dumps(operation)}")
         
+        elif cmd == "stop":
+            operation = build_operation("move_buddy", speed=0, distance=0)
+            enqueue(operation, robot.id, priority="urgent", preempt=True)
+            print(f"Queued (urgent): {json.dumps(operation)}")
+        
+        elif cmd == "script":
+            if not args:
+                names = script_store.names()
+                print(f"Stored scripts: {', '.join(names)}" if names else "No stored scripts.")
+                continue
+            try:
+                operation = build_script_operation(name=args[0])
+                enqueue(operation, robot.id)
+                print(f"Queued script '{args[0]}' ({len(operation['steps'])} steps)")
+            except ValueError as e:
+                print(f"Error: {e}")
+        
         elif cmd == "picture":
-            if os.path.exists(LATEST_IMAGE_PATH):
-                size = os.path.getsize(LATEST_IMAGE_PATH)
-                print(f"Latest image: {LATEST_IMAGE_PATH} ({size} bytes)")
+            with robot.lock:
+                image_bytes = robot.latest_image["bytes"]
+                version = robot.latest_image["version"]
+                timestamp = robot.latest_image["timestamp"]
+            if image_bytes is not None:
+                print(f"Latest image: v{version} captured at {timestamp} ({len(image_bytes)} bytes)")
             else:
                 print("No image available.")
         
         elif cmd == "queue":
+            operation_queue = robot.operation_queue
             if operation_queue:
                 print(f"Queue ({len(operation_queue)} operations):")
                 for i, op in enumerate(operation_queue):
                     print(f"  {i+1}. {json.dumps(op)}")
             else:
                 print("Queue is empty.")
+            in_flight = operation_queue.in_flight_count()
+            if in_flight:
+                print(f"{in_flight} operation(s) delivered and waiting for acknowledgement.")
+        
+        elif cmd == "robot":
+            if not args:
+                for known in robots:
+                    marker = "*" if known is robot else " "
+                    print(f" {marker} {known.id} ({len(known.operation_queue)} queued)")
+                continue
+            try:
+                robot = robots.get(args[0])
+            except (ValueError, UnknownRobotError) as e:
+                print(f"Error: {e}")
         
         else:
             print(f"Unknown command: {cmd}. Type 'help' for available commands.")
 
-
-if __name__ == '__main__':
-    import argparse
-    
-    parser = argparse.ArgumentParser(description="Buddy Flask Server")
-    parser.add_argument("--cli", action="store_true", help="Run interactive CLI (Flask only, no MCP)")
-    args = parser.parse_args()
-    
-    if args.cli:
-        # CLI mode: Flask server + interactive CLI (no MCP)
-        # Suppress Flask/Werkzeug request logging to keep CLI clean
-        werkzeug_log = logging.getLogger('werkzeug')
-        werkzeug_log.setLevel(logging.ERROR)
-        
-        flask_thread = threading.Thread(
-            target=lambda: app.run(host='0.0.0.0', port=5000, debug=False, threaded=True),
-            daemon=True
-        )
-        flask_thread.start()
-        print("Flask server started on http://0.0.0.0:5000")
-        run_cli()
-    else:
-        # Normal mode: Flask + MCP server
-        import asyncio
-        from buddy_functions import init_shared_state
-        from mcp_server import run_server
-        
-        # Initialize shared state for buddy functions (used by MCP tools)
-        init_shared_state(operation_queue, latest_image, queue_lock)
-        
-        # Suppress Flask/Werkzeug request logging (it goes to stdout and breaks MCP)
-        werkzeug_log = logging.getLogger('werkzeug')
-        werkzeug_log.setLevel(logging.ERROR)
-        
-        # Run Flask in a background thread
-        flask_thread = threading.Thread(
-            target=lambda: app.run(host='0.0.0.0', port=5000, debug=False, threaded=True),
-            daemon=True
-        )
-        flask_thread.start()
-        log("Flask server started on http://0.0.0.0:5000")
-        
-        # Run MCP server in main thread (stdio mode)
-        asyncio.run(run_server())
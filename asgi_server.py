@@ -0,0 +1,222 @@
+"""
+Async serving mode: the HTTP API and the MCP server on one asyncio event loop.
+
+`python api.py --asgi` serves the API with uvicorn on the same event loop as
+the MCP stdio server (run_server()), instead of Werkzeug's development
+server in a daemon thread. The robot hot paths are native async handlers:
+- /operation and /operation/stream park on OperationQueue.pop_async(), which
+  waits on an asyncio.Event set by append(): a waiting robot costs a
+  coroutine, not a thread, and queue tools called by MCP (run inline on the
+  loop) wake it without a thread hop
+- /upload_image and /upload_image/raw hand the frame straight to the image pipeline
+- /operation/<id>/ack
+
+Every other endpoint (frames, MJPEG, metrics, traces, robots) is the Flask
+app, mounted through a WSGI adapter that runs it on a thread pool. Responses
+are built by the helpers of http_handlers.py, like in api.py, so both modes
+answer identically. The callers (startup.py, http_workers.py, benchmark.py)
+pass in api's Flask app and RobotRegistry: this module never imports api.
+
+uvicorn and starlette come with the mcp package; a2wsgi is used for the
+Flask mount when installed.
+"""
+import asyncio
+import threading
+import warnings
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        from starlette.middleware.wsgi import WSGIMiddleware
+
+from buddy_logging import get_logger
+from http_handlers import (INVALID_BATCH_ERROR, INVALID_LEASE_ERROR, INVALID_ROBOT_ERROR, MAX_POLL_WAIT, MISSING_BODY_ERROR, OWNER_ONLY_ERROR,
+                           STREAM_HEARTBEAT, UNKNOWN_ROBOT_ERROR, UPLOAD_SUCCESS, StreamDeliveries, ack_result,
+                           decode_image_payload, poll_result, stream_event, valid_lease)
+from robots import UnknownRobotError
+
+logger = get_logger("asgi")
+
+
+def _robot(request, create: bool = False):
+    """(robot, None) for the ?robot= of the request, or (None, 400/404 response); see api.current_robot()."""
+    try:
+        return request.app.state.robots.get(request.query_params.get("robot"), create), None
+    except ValueError:
+        return None, JSONResponse(INVALID_ROBOT_ERROR, 400)
+    except UnknownRobotError:
+        return None, JSONResponse(UNKNOWN_ROBOT_ERROR, 404)
+
+
+def _query(request, name: str, convert, default=None):
+    """Query parameter converted like Flask's request.args.get(type=...): default when absent or invalid."""
+    try:
+        return convert(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+
+async def _json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def operation(request):
+    """Async /operation (same parameters as api.operation())."""
+    wait = max(0.0, min(_query(request, "wait", float, 0.0), MAX_POLL_WAIT))
+    batch_size = _query(request, "max", int)
+    lease = _query(request, "lease", float)
+    if batch_size is not None and batch_size < 1:
+        return JSONResponse(INVALID_BATCH_ERROR, 400)
+    if not valid_lease(lease):
+        return JSONResponse(INVALID_LEASE_ERROR, 400)
+    robot, error = _robot(request, create=True)
+    if error:
+        return error
+
+    ops = await robot.operation_queue.pop_async(batch_size or 1, wait, lease)
+    return JSONResponse(poll_result(robot, ops, batch_size))
+
+
+async def operation_ack(request):
+    """Async /operation/<op_id>/ack."""
+    robot, error = _robot(request)
+    if error:
+        return error
+    body, status = ack_result(robot, request.path_params["op_id"], await _json(request))
+    return JSONResponse(body, status)
+
+
+async def operation_stream(request):
+    """Async /operation/stream (server-sent events)."""
+    lease = _query(request, "lease", float)
+    if not valid_lease(lease):
+        return JSONResponse(INVALID_LEASE_ERROR, 400)
+    robot, error = _robot(request, create=True)
+    if error:
+        return error
+    deliveries = StreamDeliveries(robot, lease)
+
+    async def events():
+        logger.info("[/operation/stream] Robot %s connected", robot.id)
+        try:
+            while True:
+                ops = await robot.operation_queue.pop_async(None, STREAM_HEARTBEAT, deliveries.lease)
+                if not ops:
+                    yield ": keep-alive\n\n"
+                    continue
+                for op in ops:
+                    deliveries.pushed(op)
+                    yield stream_event(robot, op)
+        finally:
+            deliveries.release()
+            logger.info("[/operation/stream] Robot %s disconnected", robot.id)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
+async def upload_image(request):
+    """Async /upload_image (JSON base64 payload)."""
+    robot, error = _robot(request, create=True)
+    if error:
+        return error
+    image_bytes, error = decode_image_payload(await _json(request))
+    if error:
+        return JSONResponse(error, 400)
+    robot.image_pipeline.submit_frame(image_bytes)
+    return JSONResponse(UPLOAD_SUCCESS)
+
+
+async def upload_image_raw(request):
+    """Async /upload_image/raw (raw body or multipart 'image' field)."""
+    robot, error = _robot(request, create=True)
+    if error:
+        return error
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        image_file = form.get("image")
+        image_bytes = await image_file.read() if image_file is not None and hasattr(image_file, "read") else None
+    else:
+        image_bytes = await request.body()
+
+    if not image_bytes:
+        return JSONResponse(MISSING_BODY_ERROR, 400)
+    robot.image_pipeline.submit_frame(image_bytes)
+    return JSONResponse(UPLOAD_SUCCESS)
+
+
+async def owner_only(request):
+    """Frames and traces of an HTTP worker process would only be its own: served by api.py only."""
+    return JSONResponse(OWNER_ONLY_ERROR, 404)
+
+
+def build_app(flask_app, registry, owner: bool = True) -> Starlette:
+    """ASGI app: async robot endpoints, everything else served by flask_app.
+
+    owner=False (HTTP worker processes, see http_workers.py) answers 404 on
+    the frame and trace endpoints, whose state lives in the owner process.
+    """
+    routes = [
+        Route("/operation", operation, methods=["GET"]),
+        Route("/operation/stream", operation_stream, methods=["GET"]),
+        Route("/operation/{op_id}/ack", operation_ack, methods=["POST"]),
+        Route("/upload_image", upload_image, methods=["POST"]),
+        Route("/upload_image/raw", upload_image_raw, methods=["POST"]),
+    ]
+    if not owner:
+        routes += [Route(path, owner_only) for path in ("/frames", "/frames/{seq}", "/stream.mjpg", "/trace/{rest:path}")]
+    app = Starlette(routes=routes + [Mount("/", app=WSGIMiddleware(flask_app))])
+    app.state.robots = registry
+    return app
+
+
+def create_server(flask_app, registry, host: str = "0.0.0.0", port: int = 5000) -> uvicorn.Server:
+    # log_config=None: keep our logging setup (uvicorn's default one writes access logs to stdout)
+    config = uvicorn.Config(build_app(flask_app, registry), host=host, port=port, log_config=None, access_log=False,
+                            lifespan="off", timeout_keep_alive=int(MAX_POLL_WAIT) + 5,
+                            timeout_graceful_shutdown=1)
+    return uvicorn.Server(config)
+
+
+async def _serve(server: uvicorn.Server):
+    # uvicorn calls sys.exit() when it can't bind: keep the MCP server alive, like with the Flask thread
+    try:
+        await server.serve()
+    except SystemExit:
+        logger.error("ASGI server failed to start on port %d", server.config.port)
+
+
+async def serve_with_mcp(run_mcp, flask_app, registry, host: str = "0.0.0.0", port: int = 5000):
+    """Run the HTTP server and the MCP server (coroutine function run_mcp) on the current loop.
+
+    The HTTP server is shut down when the MCP server returns.
+    """
+    server = create_server(flask_app, registry, host, port)
+    http_task = asyncio.create_task(_serve(server))
+    logger.info("ASGI server started on http://%s:%d", host, port)
+    try:
+        await run_mcp()
+    finally:
+        server.should_exit = True
+        await http_task
+
+
+def start_asgi_thread(flask_app, registry, host: str = "0.0.0.0", port: int = 5000):
+    """Serve the ASGI app from its own event loop in a daemon thread (CLI mode)."""
+    server = create_server(flask_app, registry, host, port)
+    thread = threading.Thread(target=lambda: asyncio.run(_serve(server)), name="asgi", daemon=True)
+    thread.start()
+    logger.info("ASGI server started on http://%s:%d", host, port)
+    return thread
@@ -0,0 +1,289 @@
+"""
+Load benchmark: MCP tool calls in, simulated robots out.
+
+Starts the Flask API in-process on a spare port, attaches virtual robots from
+simulator.py (polling, executing, acknowledging and uploading frames), then
+fires MCP tool calls through mcp_server.call_tool(), the same code path as
+Claude Desktop minus the stdio transport. When every queued operation has
+been executed it reports:
+- tool call throughput and call_tool latency (p50/p99)
+- end-to-end command latency, MCP call to robot completion (p50/p99, from tracing.py)
+- frame processing time per pipeline stage (from metrics.py)
+- peak and growth of resident memory
+
+--cold-start N instead starts `api.py` N times the way Claude Desktop does
+and times, from process creation, the answers to MCP initialize, tools/list
+and a first tool call (which needs the robot registry, loaded in the
+background, see startup.py), against startup.COLD_START_BUDGET.
+
+Usage:
+    python benchmark.py --robots 4 --calls 1000 --concurrency 8
+    python benchmark.py --json > baseline.json
+    python benchmark.py --cold-start 5
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import urllib.request
+
+# Tool calls sent by the benchmark, with their relative frequency
+TOOL_MIX = [
+    ("speak", {"message": "Bonjour, je suis Buddy !"}, 4),
+    ("move_buddy", {"speed": 100, "distance": 0.5}, 2),
+    ("rotate_buddy", {"speed": 50, "angle": 45}, 2),
+    ("set_mood", {"mood": "happy"}, 2),
+    ("move_head", {"axis": "yes"}, 1),
+    ("multi_action", {"actions": [{"type": "talk", "message": "On y va"}, {"type": "move", "speed": 100, "distance": 1}]}, 1),
+    ("take_picture", {}, 2),
+]
+
+
+def percentile(values: list, p: float):
+    """Nearest-rank percentile of a list of numbers (None if empty)."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, -(-int(p * len(values)) // 100) - 1)]
+
+
+def current_rss() -> int:
+    """Resident memory of this process in bytes (Linux), or 0 when unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def wait_for_server(base_url: str, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(base_url + "/", timeout=1).read()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+async def fire_calls(call_tool, robot_ids: list, calls: int, concurrency: int) -> list:
+    """Send `calls` tool calls with at most `concurrency` in flight; return their latencies."""
+    names, arguments, weights = zip(*TOOL_MIX)
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_call():
+        index = random.choices(range(len(names)), weights)[0]
+        args = dict(arguments[index])
+        robot_id = random.choice(robot_ids)
+        if robot_id:
+            args["robot_id"] = robot_id
+        async with semaphore:
+            started = time.perf_counter()
+            await call_tool(names[index], args)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one_call() for _ in range(calls)))
+    return latencies
+
+
+def run_benchmark(args) -> dict:
+    import api
+    import buddy_functions
+    import metrics
+    import mcp_server
+    import simulator
+    import tracing
+    from buddy_logging import setup_logging
+
+    setup_logging()
+    if not args.verbose:
+        logging.getLogger("buddy").setLevel(logging.WARNING)
+    # Keep a trace for every operation of the run
+    tracing.TRACE_HISTORY = max(tracing.TRACE_HISTORY, args.calls * 2)
+
+    buddy_functions.init_shared_state(api.robots)
+    if args.asgi:
+        from asgi_server import start_asgi_thread
+        start_asgi_thread(api.app, api.robots, "127.0.0.1", args.port)
+    else:
+        api.start_flask_thread("127.0.0.1", args.port)
+    base_url = f"http://127.0.0.1:{args.port}"
+    wait_for_server(base_url)
+
+    rss_before = current_rss()
+    robots = simulator.start_robots(base_url, args.robots, poll_interval=args.poll_interval, wait=args.wait,
+                                    lease=args.lease, fps=args.fps, time_scale=args.time_scale)
+    robot_ids = [robot.robot_id for robot in robots]
+    # Let the robots connect and a few frames go through the pipeline
+    time.sleep(0.5)
+
+    started = time.perf_counter()
+    call_latencies = asyncio.run(fire_calls(mcp_server.call_tool, robot_ids, args.calls, args.concurrency))
+    calls_done = time.perf_counter()
+
+    # Wait until every operation has been executed by a robot
+    deadline = time.monotonic() + args.drain_timeout
+    while time.monotonic() < deadline:
+        if all(not robot.operation_queue and not robot.operation_queue.in_flight_count() for robot in api.robots):
+            break
+        time.sleep(0.05)
+    # Let the last acknowledgements arrive
+    time.sleep(0.2)
+    finished = time.perf_counter()
+
+    for robot in robots:
+        robot.stop()
+
+    summary = tracing.summary()["segments"]
+    executed = sum(robot.stats["operations"] for robot in robots)
+    stages = {}
+    for stage in ("decode", "signature", "resize", "encode"):
+        count, total = metrics.IMAGE_STAGE_SECONDS.totals(stage)
+        stages[stage] = {"count": count, "mean_ms": round(total / count * 1000, 3) if count else None}
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        "config": vars(args),
+        "tool_calls": {
+            "count": len(call_latencies),
+            "per_second": round(len(call_latencies) / (calls_done - started), 1),
+            "p50_ms": ms(percentile(call_latencies, 50)),
+            "p99_ms": ms(percentile(call_latencies, 99)),
+        },
+        "operations": {
+            "executed": executed,
+            "per_second": round(executed / (finished - started), 1),
+            "end_to_end_p50_ms": ms(summary["total"]["p50"]),
+            "end_to_end_p99_ms": ms(summary["total"]["p99"]),
+            "queue_wait_p50_ms": ms(summary["queue_wait"]["p50"]),
+            "queue_wait_p99_ms": ms(summary["queue_wait"]["p99"]),
+        },
+        "uploads": {
+            "sent": sum(robot.stats["uploads"] for robot in robots),
+            "stages": stages,
+        },
+        "robot_errors": sum(robot.stats["errors"] for robot in robots),
+        "memory": {
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "rss_growth_mb": round((current_rss() - rss_before) / 2 ** 20, 1),
+        },
+    }
+
+
+def cold_start_once(extra_args: list) -> dict:
+    """Start api.py once over stdio; milliseconds until each MCP answer."""
+    requests = [
+        ("initialize", {"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": {
+            "protocolVersion": "2024-11-05", "capabilities": {},
+            "clientInfo": {"name": "buddy-benchmark", "version": "1.0"}}}),
+        ("tools_list", {"jsonrpc": "2.0", "id": 2, "method": "tools/list"}),
+        ("first_call", {"jsonrpc": "2.0", "id": 3, "method": "tools/call",
+                        "params": {"name": "take_picture", "arguments": {}}}),
+    ]
+    initialized = {"jsonrpc": "2.0", "method": "notifications/initialized"}
+    env = dict(os.environ, BUDDY_LOG_LEVEL="WARNING")
+    api_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "api.py")
+
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, api_path] + extra_args, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env)
+    timings = {}
+    try:
+        for name, message in requests:
+            process.stdin.write((json.dumps(message) + "\n").encode())
+            process.stdin.flush()
+            reply = json.loads(process.stdout.readline())
+            timings[name] = round((time.perf_counter() - started) * 1000, 1)
+            if "error" in reply:
+                raise RuntimeError(f"{name} failed: {reply['error']}")
+            if name == "initialize":
+                process.stdin.write((json.dumps(initialized) + "\n").encode())
+    finally:
+        process.stdin.close()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return timings
+
+
+def measure_cold_start(runs: int, asgi: bool = False) -> dict:
+    """Median and worst cold start over several runs of api.py."""
+    from startup import COLD_START_BUDGET
+
+    samples = [cold_start_once(["--asgi"] if asgi else []) for _ in range(runs)]
+    result = {"runs": runs, "budget_ms": COLD_START_BUDGET}
+    for name in samples[0]:
+        values = [sample[name] for sample in samples]
+        result[name] = {"p50_ms": percentile(values, 50), "max_ms": max(values)}
+    return result
+
+
+def print_cold_start_report(result: dict):
+    budget = result["budget_ms"]
+    print(f"Cold start of api.py over {result['runs']} run(s), from process creation:")
+    for name, label in (("initialize", "initialize"), ("tools_list", "tools/list"), ("first_call", "first tool call")):
+        print(f"  {label:<16} p50 {result[name]['p50_ms']} ms, max {result[name]['max_ms']} ms")
+    verdict = "within" if result["initialize"]["p50_ms"] <= budget else "OVER"
+    print(f"Budget:   {budget:.0f} ms for initialize (interpreter startup included here): {verdict}")
+
+
+def print_report(result: dict):
+    calls, ops, uploads, memory = result["tool_calls"], result["operations"], result["uploads"], result["memory"]
+    print(f"Tool calls:   {calls['count']} at {calls['per_second']}/s, "
+          f"call_tool p50 {calls['p50_ms']} ms, p99 {calls['p99_ms']} ms")
+    print(f"Operations:   {ops['executed']} executed at {ops['per_second']}/s, "
+          f"end-to-end p50 {ops['end_to_end_p50_ms']} ms, p99 {ops['end_to_end_p99_ms']} ms "
+          f"(queue wait p50 {ops['queue_wait_p50_ms']} ms, p99 {ops['queue_wait_p99_ms']} ms)")
+    stages = ", ".join(f"{name} {stage['mean_ms']} ms" for name, stage in uploads["stages"].items())
+    print(f"Uploads:      {uploads['sent']} frames, mean per stage: {stages}")
+    print(f"Memory:       peak RSS {memory['peak_rss_mb']} MB, growth {memory['rss_growth_mb']} MB")
+    if result["robot_errors"]:
+        print(f"Robot errors: {result['robot_errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Buddy server with simulated robots")
+    parser.add_argument("--robots", type=int, default=2, help="Number of virtual robots")
+    parser.add_argument("--calls", type=int, default=500, help="Number of MCP tool calls")
+    parser.add_argument("--concurrency", type=int, default=8, help="Tool calls in flight at once")
+    parser.add_argument("--fps", type=float, default=5.0, help="Frames uploaded per second and per robot")
+    parser.add_argument("--wait", type=float, default=5.0, help="Robot long-poll wait (seconds, 0 = short polling)")
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="Seconds between idle polls when short polling")
+    parser.add_argument("--lease", type=float, default=30.0, help="Robot lease (seconds)")
+    parser.add_argument("--time-scale", type=float, default=0.01, help="Multiply simulated operation durations")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="Max seconds to wait for the robots to finish")
+    parser.add_argument("--port", type=int, default=5055, help="Port of the in-process server")
+    parser.add_argument("--asgi", action="store_true", help="Serve HTTP with the async server (asgi_server.py)")
+    parser.add_argument("--cold-start", type=int, default=0, metavar="RUNS",
+                        help="Measure the cold start of api.py over RUNS runs instead of the load benchmark")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Keep the server's INFO logs")
+    args = parser.parse_args()
+
+    if args.cold_start:
+        result = measure_cold_start(args.cold_start, args.asgi)
+        report = print_cold_start_report
+    else:
+        result = run_benchmark(args)
+        report = print_report
+    if args.json:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    else:
+        report(result)
+
+
+if __name__ == '__main__':
+    main()
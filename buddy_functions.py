@@ -3,49 +3,227 @@ Buddy robot tool implementations.
 Each function corresponds to an MCP tool and takes parameters directly.
 """
 import json
-import sys
-import os
-import base64
-from mcp.types import TextContent, ImageContent
+import threading
+import time
+from buddy_logging import get_logger
+from metrics import TAKE_PICTURE_BYTES, TAKE_PICTURE_SECONDS
+from operation_store import DEFAULT_PRIORITY, PRIORITIES
+from scripts import SCRIPT_NAME_PATTERN, ScriptStore
+from tool_registry import TOOLS, register_tool
 
 # Shared state - initialized by api.py
-operation_queue = None
-latest_image = None
-queue_lock = None
+robots = None
+# Set by init_shared_state(): the MCP server answers the handshake before the
+# HTTP side (and the registry) has finished loading, see startup.py
+state_ready = threading.Event()
+# Why the shared state will never be ready (see fail_shared_state())
+state_error = None
+
+# Optional robot_id argument shared by every tool schema
+ROBOT_ID_PROPERTY = {
+    "type": "string",
+    "description": "Id of the Buddy unit to control when several robots are connected (default: the main robot). "
+                   "A robot is known once it has polled the server or if listed in BUDDY_ROBOTS",
+    "pattern": "^[A-Za-z0-9_-]{1,32}$"
+}
+
+# Optional delivery arguments shared by every tool that queues an operation
+PRIORITY_PROPERTY = {
+    "type": "string",
+    "description": "Delivery priority. Higher priorities are sent to Buddy before anything queued at a lower one. Use 'urgent' for stops and safety reactions.",
+    "enum": list(PRIORITIES),
+    "default": DEFAULT_PRIORITY
+}
+PREEMPT_PROPERTY = {
+    "type": "boolean",
+    "description": "If true, cancel pending movement commands queued with a lower priority (e.g. stop now instead of finishing a queued route)",
+    "default": False
+}
+
+
+logger = get_logger("tools")
 
-# Path to the latest image file
-LATEST_IMAGE_PATH = os.path.join(os.path.dirname(__file__), "latest_image.png")
 
+def init_shared_state(registry):
+    """Initialize shared state from api.py (the RobotRegistry)"""
+    global robots
+    robots = registry
+    state_ready.set()
 
-def log(msg):
-    print(msg, file=sys.stderr)
 
+def fail_shared_state(error: BaseException):
+    """Record that the HTTP side failed to load, so tool calls fail at once instead of waiting for it."""
+    global state_error
+    if state_ready.is_set():
+        return
+    state_error = error
+    state_ready.set()
 
-def init_shared_state(queue, image, lock):
-    """Initialize shared state from api.py"""
-    global operation_queue, latest_image, queue_lock
-    operation_queue = queue
-    latest_image = image
-    queue_lock = lock
 
+def shared_state_error():
+    """The error recorded by fail_shared_state(), or None."""
+    return state_error
 
-def queue_operation(operation: dict, message: str):
-    """Queue an operation and return response with JSON debug info."""
-    with queue_lock:
-        operation_queue.append(operation)
-        queue_size = len(operation_queue)
-        queue_id = id(operation_queue)
+
+def enqueue(operation: dict, robot_id: str = None, priority: str = DEFAULT_PRIORITY, preempt: bool = False) -> str:
+    """Append an operation to a robot's queue and wake up long-polling robots.
+    
+    Returns the id of the queued operation.
+    """
+    return robots.get(robot_id).operation_queue.append(operation, priority, preempt)
+
+
+def queue_operation(operation: dict, message: str, robot_id: str = None,
+                    priority: str = DEFAULT_PRIORITY, preempt: bool = False):
+    """Queue an operation and return response with JSON debug info.
     
-    # Log with queue details for debugging
-    log(f"Queued: {json.dumps(operation)}")
-    log(f"Queue size after append: {queue_size} (Queue ID: {queue_id})")
+    The response gives the operation id, which is also its trace id (/trace/<id>).
+    """
+    robot = robots.get(robot_id)
+    op_id = robot.operation_queue.append(operation, priority, preempt)
+    operation = {**operation, "id": op_id}
+    if priority != DEFAULT_PRIORITY or preempt:
+        message += f" [priority: {priority}{', preempting lower-priority motion' if preempt else ''}]"
+    logger.info("Queued %s", operation["type"], extra={"robot": robot.id, "priority": priority, "id": op_id})
+    logger.debug("Queued operation: %s", operation)
     
-    return [TextContent(type="text", text=f"{message}\n\nOperation JSON:\n```json\n{json.dumps(operation, indent=2)}\n```")]
+    # mcp.types is only imported by MCP tool calls, not by the CLI
+    from mcp.types import TextContent
+    return [TextContent(type="text", text=f"{message} (operation id: {op_id})\n\n"
+                                          f"Operation JSON:\n```json\n{json.dumps(operation, indent=2)}\n```")]
+
+
+# --- Operation builders ---
+# Shared by the tool handlers, multi_action and the CLI (build_operation).
+
+def build_move_operation(speed: float, distance: float) -> dict:
+    """MoveOperation. Speed is forced positive, direction comes from the distance sign."""
+    return {"type": "MoveOperation", "speed": abs(speed), "distance": distance}
+
+
+def build_rotate_operation(speed: float, angle: float) -> dict:
+    """RotateOperation. Speed is forced positive, direction comes from the angle sign."""
+    return {"type": "RotateOperation", "speed": abs(speed), "angle": angle}
+
+
+def build_talk_operation(message: str, volume: int = 300) -> dict:
+    """TalkOperation."""
+    return {"type": "TalkOperation", "message": message, "volume": volume}
+
+
+def build_head_operation(axis: str, speed: float = 40.0, angle: float = 20.0) -> dict:
+    """HeadOperation. axis 'yes' nods, anything else shakes."""
+    axis_value = "Yes" if axis.lower() == "yes" else "No"
+    return {"type": "HeadOperation", "speed": speed, "angle": angle, "axis": axis_value}
+
+
+def build_mood_operation(mood: str) -> dict:
+    """MoodOperation."""
+    return {"type": "MoodOperation", "mood": mood.upper()}
+
+
+def build_wait_operation(seconds: float) -> dict:
+    """WaitOperation (script steps only): pause before the next step."""
+    return {"type": "WaitOperation", "seconds": float(seconds)}
+
+
+def build_action(action: dict):
+    """(operation, short description) of one multi_action action, (None, None) for an unknown type."""
+    action_type = action.get("type")
+    
+    if action_type == "move":
+        operation = build_move_operation(action.get("speed", 100), action.get("distance", 0))
+        direction = "forward" if operation["distance"] > 0 else "backward"
+        description = f"move {direction} {abs(operation['distance'])}m"
+    
+    elif action_type == "rotate":
+        operation = build_rotate_operation(action.get("speed", 50), action.get("angle", 0))
+        direction = "right" if operation["angle"] > 0 else "left"
+        description = f"rotate {direction} {abs(operation['angle'])}°"
+    
+    elif action_type == "talk":
+        operation = build_talk_operation(action.get("message", ""), action.get("volume", 300))
+        description = f"say '{operation['message']}'"
+    
+    elif action_type == "head":
+        operation = build_head_operation(action.get("axis", "yes"), action.get("speed", 40.0), action.get("angle", 20.0))
+        head_action = "nod" if operation["axis"] == "Yes" else "shake"
+        description = f"{head_action} head"
+    
+    elif action_type == "mood":
+        mood = action.get("mood", "NEUTRAL")
+        operation = build_mood_operation(mood)
+        description = f"set mood to {mood}"
+    
+    else:
+        return None, None
+    
+    return operation, description
+
+
+# Parameters of one multi_action action, shared with the action steps of run_script
+ACTION_PROPERTIES = {
+    "speed": {
+        "type": "number",
+        "description": "Speed parameter (for move/rotate/head actions). Must be positive."
+    },
+    "distance": {
+        "type": "number",
+        "description": "Distance in meters (for move action). Positive = forward, negative = backward."
+    },
+    "angle": {
+        "type": "number",
+        "description": "Angle in degrees (for rotate/head actions). Positive = right/yes, negative = left/no."
+    },
+    "message": {
+        "type": "string",
+        "description": "Text to speak (for talk action)"
+    },
+    "volume": {
+        "type": "integer",
+        "description": "Volume level 100-500 (for talk action, default: 300)"
+    },
+    "axis": {
+        "type": "string",
+        "description": "Head movement type (for head action): 'yes' = nod, 'no' = shake",
+        "enum": ["yes", "no"]
+    },
+    "mood": {
+        "type": "string",
+        "description": "Facial expression (for mood action)",
+        "enum": ["happy", "sad", "angry", "surprised", "neutral", "afraid", "disgusted", "contempt"]
+    }
+}
 
 
 # --- Tool implementations ---
 
-def move_buddy(speed: float, distance: float):
+@register_tool(
+    "move_buddy",
+    description="Move Buddy forward or backward. IMPORTANT: Speed must always be positive. Direction is controlled by distance sign (+ forward, - backward). Example: move_buddy(speed=100, distance=-0.5) moves backward.",
+    input_schema={
+        "type": "object",
+        "properties": {
+            "speed": {
+                "type": "number",
+                "description": "Movement speed - MUST be positive (recommended: 50-200). Direction is NOT determined by speed.",
+                "minimum": 0,
+                "maximum": 500
+            },
+            "distance": {
+                "type": "number",
+                "description": "Distance to move in meters. POSITIVE = forward, NEGATIVE = backward. Example: 0.5 moves forward, -0.5 moves backward.",
+            },
+            "robot_id": ROBOT_ID_PROPERTY,
+            "priority": PRIORITY_PROPERTY,
+            "preempt": PREEMPT_PROPERTY
+        },
+        "required": ["speed", "distance"]
+    },
+    builder=build_move_operation
+)
+def move_buddy(speed: float, distance: float, robot_id: str = None,
+               priority: str = DEFAULT_PRIORITY, preempt: bool = False):
     """Move Buddy forward or backward.
     
     Parameter Rules:
@@ -57,21 +235,40 @@ def move_buddy(speed: float, distance: float):
     - move_buddy(100, -0.5)  -> Move backward 0.5m at speed 100
     - move_buddy(-100, 0.5)  -> Move forward 0.5m at speed 100 (speed auto-corrected)
     """
-    # Ensure speed is always positive (critical rule!)
-    speed = abs(speed)
-    
-    operation = {
-        "type": "MoveOperation",
-        "speed": speed,
-        "distance": distance
-    }
+    operation = build_move_operation(speed, distance)
     
     # Direction is determined by distance sign, NOT speed
     direction = "forward" if distance > 0 else "backward"
-    return queue_operation(operation, f"Queued move {direction} at speed {speed} for {abs(distance)}m")
-
-
-def rotate_buddy(speed: float, angle: float):
+    return queue_operation(operation, f"Queued move {direction} at speed {operation['speed']} for {abs(distance)}m",
+                           robot_id, priority, preempt)
+
+
+@register_tool(
+    "rotate_buddy",
+    description="Rotate Buddy left or right. IMPORTANT: Speed must always be positive. Direction is controlled by angle sign (+ right, - left). Example: rotate_buddy(speed=50, angle=-90) rotates left.",
+    input_schema={
+        "type": "object",
+        "properties": {
+            "speed": {
+                "type": "number",
+                "description": "Rotation speed - MUST be positive (recommended: 50-200). Direction is NOT determined by speed.",
+                "minimum": 0,
+                "maximum": 500
+            },
+            "angle": {
+                "type": "number",
+                "description": "Angle to rotate in degrees. POSITIVE = turn right, NEGATIVE = turn left. Example: 90 turns right, -90 turns left.",
+            },
+            "robot_id": ROBOT_ID_PROPERTY,
+            "priority": PRIORITY_PROPERTY,
+            "preempt": PREEMPT_PROPERTY
+        },
+        "required": ["speed", "angle"]
+    },
+    builder=build_rotate_operation
+)
+def rotate_buddy(speed: float, angle: float, robot_id: str = None,
+                 priority: str = DEFAULT_PRIORITY, preempt: bool = False):
     """Rotate Buddy left or right by the specified angle.
     
     Parameter Rules:
@@ -83,74 +280,227 @@ def rotate_buddy(speed: float, angle: float):
     - rotate_buddy(50, -90)  -> Turn left 90° at speed 50
     - rotate_buddy(-50, 90)  -> Turn right 90° at speed 50 (speed auto-corrected)
     """
-    # Ensure speed is always positive (critical rule!)
-    speed = abs(speed)
-    
-    operation = {
-        "type": "RotateOperation",
-        "speed": speed,
-        "angle": angle
-    }
+    operation = build_rotate_operation(speed, angle)
     
     # Direction is determined by angle sign, NOT speed
     direction = "right" if angle > 0 else "left"
-    return queue_operation(operation, f"Queued rotation {direction} at speed {speed} for {abs(angle)} degrees")
-
-
-def speak(message: str, volume: int = 300):
+    return queue_operation(operation, f"Queued rotation {direction} at speed {operation['speed']} for {abs(angle)} degrees",
+                           robot_id, priority, preempt)
+
+
+@register_tool(
+    "speak",
+    description="Make Buddy say something out loud. Use this for standalone speech. If you want Buddy to talk WHILE doing something else (moving, rotating), use multi_action instead. Perfect for greetings, announcements, or any verbal communication.",
+    input_schema={
+        "type": "object",
+        "properties": {
+            "message": {
+                "type": "string",
+                "description": "The text that Buddy should speak"
+            },
+            "volume": {
+                "type": "integer",
+                "description": "Volume level (100-500, default: 300)",
+                "minimum": 100,
+                "maximum": 500,
+                "default": 300
+            },
+            "robot_id": ROBOT_ID_PROPERTY,
+            "priority": PRIORITY_PROPERTY,
+            "preempt": PREEMPT_PROPERTY
+        },
+        "required": ["message"]
+    },
+    builder=build_talk_operation
+)
+def speak(message: str, volume: int = 300, robot_id: str = None,
+          priority: str = DEFAULT_PRIORITY, preempt: bool = False):
     """Make Buddy say something out loud."""
-    operation = {
-        "type": "TalkOperation",
-        "message": message,
-        "volume": volume
-    }
-    return queue_operation(operation, f"Queued speech: '{message}' at volume {volume}")
-
-
-def move_head(axis: str, speed: float = 40.0, angle: float = 20.0):
+    operation = build_talk_operation(message, volume)
+    return queue_operation(operation, f"Queued speech: '{message}' at volume {volume}", robot_id, priority, preempt)
+
+
+@register_tool(
+    "move_head",
+    description="Make Buddy nod (yes) or shake (no) his head. Use 'yes' for agreement/approval or 'no' for disagreement/disapproval. Can be combined with other actions using multi_action (e.g., nod while saying 'Yes!')",
+    input_schema={
+        "type": "object",
+        "properties": {
+            "axis": {
+                "type": "string",
+                "description": "Head movement type",
+                "enum": ["yes", "no"]
+            },
+            "speed": {
+                "type": "number",
+                "description": "Movement speed (default: 40.0)",
+                "minimum": 0,
+                "maximum": 100,
+                "default": 40.0
+            },
+            "angle": {
+                "type": "number",
+                "description": "Movement angle (default: 20.0)",
+                "minimum": 0,
+                "maximum": 90,
+                "default": 20.0
+            },
+            "robot_id": ROBOT_ID_PROPERTY,
+            "priority": PRIORITY_PROPERTY,
+            "preempt": PREEMPT_PROPERTY
+        },
+        "required": ["axis"]
+    },
+    builder=build_head_operation
+)
+def move_head(axis: str, speed: float = 40.0, angle: float = 20.0, robot_id: str = None,
+              priority: str = DEFAULT_PRIORITY, preempt: bool = False):
     """Nod (axis='yes') or shake (axis='no') Buddy's head."""
-    axis_value = "Yes" if axis.lower() == "yes" else "No"
-    operation = {
-        "type": "HeadOperation",
-        "speed": speed,
-        "angle": angle,
-        "axis": axis_value
-    }
-    action = "nod" if axis_value == "Yes" else "shake"
-    return queue_operation(operation, f"Queued head {action} at speed {speed} with angle {angle}")
-
-
-def set_mood(mood: str):
+    operation = build_head_operation(axis, speed, angle)
+    action = "nod" if operation["axis"] == "Yes" else "shake"
+    return queue_operation(operation, f"Queued head {action} at speed {speed} with angle {angle}", robot_id, priority, preempt)
+
+
+@register_tool(
+    "set_mood",
+    description="Change Buddy's facial expression/mood displayed on the screen. Use this to convey emotions visually. Can be combined with speech and gestures using multi_action for more expressive interactions (e.g., smile while saying 'Hello!')",
+    input_schema={
+        "type": "object",
+        "properties": {
+            "mood": {
+                "type": "string",
+                "description": "The mood/expression to display",
+                "enum": ["happy", "sad", "angry", "surprised", "neutral", "afraid", "disgusted", "contempt"]
+            },
+            "robot_id": ROBOT_ID_PROPERTY,
+            "priority": PRIORITY_PROPERTY,
+            "preempt": PREEMPT_PROPERTY
+        },
+        "required": ["mood"]
+    },
+    builder=build_mood_operation
+)
+def set_mood(mood: str, robot_id: str = None,
+             priority: str = DEFAULT_PRIORITY, preempt: bool = False):
     """Set Buddy's facial expression/mood displayed on screen."""
-    operation = {
-        "type": "MoodOperation",
-        "mood": mood.upper()
+    operation = build_mood_operation(mood)
+    return queue_operation(operation, f"Queued mood change to {operation['mood']}", robot_id, priority, preempt)
+
+
+@register_tool(
+    "take_picture",
+    description="Capture and return the latest image from Buddy's camera. Returns the image with timestamp. Use this to see what Buddy sees, analyze the environment, or track a person. Set frames_ago to look at an earlier frame from the recent history.",
+    input_schema={
+        "type": "object",
+        "properties": {
+            "frames_ago": {
+                "type": "integer",
+                "description": "How many frames back to look (0 = latest, default). Only the last few frames are kept.",
+                "minimum": 0,
+                "default": 0
+            },
+            "robot_id": ROBOT_ID_PROPERTY
+        },
+        "required": []
     }
-    return queue_operation(operation, f"Queued mood change to {mood.upper()}")
-
-
-def take_picture():
-    """Get the latest camera image captured by Buddy."""
-    if not os.path.exists(LATEST_IMAGE_PATH):
+)
+def take_picture(frames_ago: int = 0, robot_id: str = None):
+    """Get the latest camera image captured by Buddy.
+    
+    Served from the in-memory frame cache published by the image pipeline:
+    no file I/O, and the ImageContent is only rebuilt when a new frame arrived.
+    The pipeline only bumps the version when the scene actually changed, which
+    is reported back so the agent can skip re-analysing an identical picture.
+    With frames_ago > 0, an older frame is returned from the frame history.
+    """
+    started = time.perf_counter()
+    result = _take_picture(robots.get(robot_id), frames_ago)
+    TAKE_PICTURE_SECONDS.observe(time.perf_counter() - started)
+    if len(result) > 1:
+        TAKE_PICTURE_BYTES.observe(len(result[1].data))
+    return result
+
+
+def _take_picture(robot, frames_ago: int):
+    """Build the take_picture result for a robot."""
+    from mcp.types import ImageContent, TextContent
+    if frames_ago:
+        return _take_past_picture(robot, frames_ago)
+    
+    latest_image = robot.latest_image
+    with robot.lock:
+        version = latest_image.get("version")
+        image_base64 = latest_image.get("base64")
+        mime_type = latest_image.get("mime_type") or "image/png"
+        timestamp = latest_image.get("timestamp") or "unknown"
+    
+    if image_base64 is None:
         return [TextContent(type="text", text="No image available. The robot hasn't sent any image yet.")]
     
-    try:
-        with open(LATEST_IMAGE_PATH, 'rb') as f:
-            image_bytes = f.read()
-        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-        
-        with queue_lock:
-            timestamp = latest_image.get("timestamp", "unknown")
-        
-        return [
-            TextContent(type="text", text=f"Image captured at {timestamp}"),
-            ImageContent(type="image", data=image_base64, mimeType="image/png")
-        ]
-    except Exception as e:
-        return [TextContent(type="text", text=f"Error reading image: {e}")]
-
-
-def multi_action(actions: list):
+    cached_version, image_content = robot.picture_cache
+    if cached_version != version:
+        image_content = ImageContent(type="image", data=image_base64, mimeType=mime_type)
+        robot.picture_cache = (version, image_content)
+    
+    text = f"Image captured at {timestamp}"
+    if cached_version is not None:
+        changed = "changed" if cached_version != version else "unchanged"
+        text += f" (scene {changed} since last picture)"
+    
+    return [
+        TextContent(type="text", text=text),
+        image_content
+    ]
+
+
+def _take_past_picture(robot, frames_ago: int):
+    """Return an older frame from a robot's frame history."""
+    from mcp.types import ImageContent, TextContent
+    with robot.lock:
+        available = len(robot.frame_history)
+        frame = robot.frame_history[-1 - frames_ago] if 0 < frames_ago < available else None
+    
+    if frame is None:
+        return [TextContent(type="text", text=f"No image {frames_ago} frame(s) ago. Only {available} frame(s) are kept in history.")]
+    
+    return [
+        TextContent(type="text", text=f"Image #{frame['seq']} captured at {frame['timestamp']} ({frames_ago} frame(s) ago)"),
+        ImageContent(type="image", data=frame["base64"], mimeType=frame["mime_type"])
+    ]
+
+
+@register_tool(
+    "multi_action",
+    description="Execute multiple actions SIMULTANEOUSLY. This makes Buddy more fluid and natural by doing several things at once. Examples: move while talking, rotate while speaking, greet someone (talk + nod + smile). Use this instead of calling individual tools sequentially when you want Buddy to multitask.",
+    input_schema={
+        "type": "object",
+        "properties": {
+            "actions": {
+                "type": "array",
+                "description": "List of actions to execute simultaneously. Each action has a 'type' and its specific parameters.",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "type": {
+                            "type": "string",
+                            "description": "Type of action: 'move' (move forward/backward), 'rotate' (turn left/right), 'talk' (speak), 'head' (nod/shake), 'mood' (facial expression)",
+                            "enum": ["move", "rotate", "talk", "head", "mood"]
+                        },
+                        **ACTION_PROPERTIES
+                    },
+                    "required": ["type"]
+                },
+                "minItems": 1
+            },
+            "robot_id": ROBOT_ID_PROPERTY,
+            "priority": PRIORITY_PROPERTY,
+            "preempt": PREEMPT_PROPERTY
+        },
+        "required": ["actions"]
+    }
+)
+def multi_action(actions: list, robot_id: str = None,
+                 priority: str = DEFAULT_PRIORITY, preempt: bool = False):
     """Execute multiple operations simultaneously.
     
     This allows Buddy to do multiple things at once, making interactions more fluid and natural.
@@ -180,61 +530,12 @@ def multi_action(actions: list):
     action_descriptions = []
     
     for action in actions:
-        action_type = action.get("type")
+        operation, description = build_action(action)
+        if operation is None:
+            continue
         
-        if action_type == "move":
-            speed = abs(action.get("speed", 100))
-            distance = action.get("distance", 0)
-            operations.append({
-                "type": "MoveOperation",
-                "speed": speed,
-                "distance": distance
-            })
-            direction = "forward" if distance > 0 else "backward"
-            action_descriptions.append(f"move {direction} {abs(distance)}m")
-            
-        elif action_type == "rotate":
-            speed = abs(action.get("speed", 50))
-            angle = action.get("angle", 0)
-            operations.append({
-                "type": "RotateOperation",
-                "speed": speed,
-                "angle": angle
-            })
-            direction = "right" if angle > 0 else "left"
-            action_descriptions.append(f"rotate {direction} {abs(angle)}°")
-            
-        elif action_type == "talk":
-            message = action.get("message", "")
-            volume = action.get("volume", 300)
-            operations.append({
-                "type": "TalkOperation",
-                "message": message,
-                "volume": volume
-            })
-            action_descriptions.append(f"say '{message}'")
-            
-        elif action_type == "head":
-            axis = action.get("axis", "yes")
-            axis_value = "Yes" if axis.lower() == "yes" else "No"
-            speed = action.get("speed", 40.0)
-            angle = action.get("angle", 20.0)
-            operations.append({
-                "type": "HeadOperation",
-                "speed": speed,
-                "angle": angle,
-                "axis": axis_value
-            })
-            head_action = "nod" if axis_value == "Yes" else "shake"
-            action_descriptions.append(f"{head_action} head")
-            
-        elif action_type == "mood":
-            mood = action.get("mood", "NEUTRAL")
-            operations.append({
-                "type": "MoodOperation",
-                "mood": mood.upper()
-            })
-            action_descriptions.append(f"set mood to {mood}")
+        operations.append(operation)
+        action_descriptions.append(description)
     
     # Create MultiOperation
     multi_operation = {
@@ -246,41 +547,253 @@ def multi_action(actions: list):
     description = " + ".join(action_descriptions)
     message = f"Queued multi-action: {description} ({len(operations)} operations)"
     
-    return queue_operation(multi_operation, message)
+    return queue_operation(multi_operation, message, robot_id, priority, preempt)
+
+
+
+# --- Scripts ---
+# A choreographed behaviour (greet: talk + nod + smile, then rotate, then speak
+# again) costs one run_script call instead of one tool call per step. The
+# steps are validated and compiled on the server into the flat plan of one
+# ScriptOperation, which the robot runs step after step:
+#   {"type": "ScriptOperation", "name": "greet", "steps": [
+#       {"type": "MultiOperation", "operations": [...]},
+#       {"type": "RotateOperation", ...}, {"type": "WaitOperation", "seconds": 1.0}, ...]}
+# Stored scripts (save_as) are compiled once and run again by name.
+
+# Limits of a script, checked at compile time
+MAX_SCRIPT_STEPS = 100
+MAX_SCRIPT_DEPTH = 4
+MAX_SCRIPT_REPEAT = 20
+MAX_SCRIPT_WAIT = 30.0
+
+SCRIPT_STEP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "type": {
+            "type": "string",
+            "description": "Step type: an action ('move', 'rotate', 'talk', 'head', 'mood', same parameters as multi_action), 'parallel' (its 'steps' are actions run at the same time), 'sequence' (its 'steps' run one after another), 'repeat' (its 'steps' run 'times' times) or 'wait' (pause for 'seconds')",
+            "enum": ["move", "rotate", "talk", "head", "mood", "parallel", "sequence", "repeat", "wait"]
+        },
+        **ACTION_PROPERTIES,
+        "seconds": {
+            "type": "number",
+            "description": f"Pause duration in seconds (for wait, max {MAX_SCRIPT_WAIT:g})",
+            "minimum": 0,
+            "maximum": MAX_SCRIPT_WAIT
+        },
+        "times": {
+            "type": "integer",
+            "description": f"Number of repetitions (for repeat, max {MAX_SCRIPT_REPEAT})",
+            "minimum": 1,
+            "maximum": MAX_SCRIPT_REPEAT
+        },
+        "steps": {
+            "type": "array",
+            "description": "Nested steps (for parallel, sequence and repeat)",
+            "items": {"$ref": "#/$defs/step"},
+            "minItems": 1
+        }
+    },
+    "required": ["type"]
+}
 
+SCRIPT_NAME_PROPERTY = {
+    "type": "string",
+    "pattern": SCRIPT_NAME_PATTERN.pattern
+}
 
+# Stored scripts, by name (BUDDY_SCRIPTS_FILE to keep them across restarts)
+script_store = ScriptStore()
 
 
-# --- Tool dispatch dictionary ---
+def compile_script(steps: list):
+    """Compile script steps into the flat plan of a ScriptOperation.
+    
+    Sequences and repeats are unrolled, parallel blocks become a
+    MultiOperation and waits a WaitOperation, so the robot only runs a list
+    of operations one after the other. Returns (plan, step descriptions).
+    Raises ValueError for a step that cannot be compiled or a plan longer
+    than MAX_SCRIPT_STEPS.
+    """
+    plan = []
+    descriptions = []
+    
+    def emit(block: list, depth: int):
+        if depth > MAX_SCRIPT_DEPTH:
+            raise ValueError(f"Script nested more than {MAX_SCRIPT_DEPTH} levels deep")
+        for step in block:
+            step_type = step.get("type")
+            if step_type in ("sequence", "repeat"):
+                for _ in range(step.get("times", 1) if step_type == "repeat" else 1):
+                    emit(step.get("steps", []), depth + 1)
+                continue
+            
+            if step_type == "parallel":
+                built = [build_action(action) for action in step.get("steps", [])]
+                if not built or any(operation is None for operation, _ in built):
+                    raise ValueError("A parallel block can only contain actions (move, rotate, talk, head, mood)")
+                operation = {"type": "MultiOperation", "operations": [operation for operation, _ in built]}
+                description = " + ".join(description for _, description in built)
+            elif step_type == "wait":
+                operation = build_wait_operation(step.get("seconds", 1.0))
+                description = f"wait {operation['seconds']:g}s"
+            else:
+                operation, description = build_action(step)
+                if operation is None:
+                    raise ValueError(f"Unknown script step type: {step_type!r}")
+            
+            if len(plan) >= MAX_SCRIPT_STEPS:
+                raise ValueError(f"Script too long: more than {MAX_SCRIPT_STEPS} steps once repeats are unrolled")
+            plan.append(operation)
+            descriptions.append(description)
+    
+    emit(steps, 1)
+    if not plan:
+        raise ValueError("Script has no steps")
+    return plan, descriptions
+
+
+def _script_plan(steps: list = None, name: str = None):
+    """(plan, descriptions) of inline steps, or of the stored script `name`."""
+    if steps is not None and name is not None:
+        raise ValueError("Give either the script steps or the name of a stored script, not both")
+    if steps is not None:
+        return compile_script(steps)
+    if name is None:
+        raise ValueError("Give the script steps, or the name of a stored script")
+    
+    script = script_store.get(name)
+    if script is None:
+        known = ", ".join(script_store.names()) or "none"
+        raise ValueError(f"Unknown script: {name!r} (stored scripts: {known})")
+    if script["plan"] is None:
+        # Loaded from BUDDY_SCRIPTS_FILE: validate and compile on first use
+        TOOLS["run_script"].parse({"steps": script["steps"]})
+        script_store.set_plan(name, *compile_script(script["steps"]))
+    return script["plan"], script["descriptions"]
+
+
+def _script_operation(plan: list, name: str = None) -> dict:
+    # New list per run: the step operations themselves are never modified once compiled
+    operation = {"type": "ScriptOperation", "steps": list(plan)}
+    if name:
+        operation["name"] = name
+    return operation
+
+
+def build_script_operation(steps: list = None, name: str = None) -> dict:
+    """ScriptOperation of inline steps or of a stored script."""
+    plan, _ = _script_plan(steps, name)
+    return _script_operation(plan, name)
+
+
+def _describe_script(descriptions: list, limit: int = 8) -> str:
+    shown = ", ".join(descriptions[:limit])
+    if len(descriptions) > limit:
+        shown += f", ... ({len(descriptions) - limit} more)"
+    return f"{len(descriptions)} step(s): {shown}"
+
+
+@register_tool(
+    "run_script",
+    description="Run a whole choreographed behaviour in ONE call: a script of steps executed by Buddy one after another, with parallel blocks (several actions at once, like multi_action), waits, nested sequences and repeats. Example greeting: steps=[{type: parallel, steps: [{type: talk, message: 'Hello!'}, {type: head, axis: yes}, {type: mood, mood: happy}]}, {type: rotate, speed: 50, angle: 90}, {type: wait, seconds: 1}, {type: talk, message: 'Nice to meet you'}]. Store it with save_as='greet' and replay it later with name='greet' (see list_scripts). Prefer this over several separate tool calls for any multi-step behaviour.",
+    input_schema={
+        "type": "object",
+        "$defs": {"step": SCRIPT_STEP_SCHEMA},
+        "properties": {
+            "steps": {
+                "type": "array",
+                "description": "The script: steps run one after another. Omit to run a stored script by name.",
+                "items": {"$ref": "#/$defs/step"},
+                "minItems": 1
+            },
+            "name": {
+                **SCRIPT_NAME_PROPERTY,
+                "description": "Name of a stored script to run (instead of steps)"
+            },
+            "save_as": {
+                **SCRIPT_NAME_PROPERTY,
+                "description": "Store these steps under this name for later runs (replaces a script with the same name)"
+            },
+            "run": {
+                "type": "boolean",
+                "description": "Set to false with save_as to only store the script without running it",
+                "default": True
+            },
+            "robot_id": ROBOT_ID_PROPERTY,
+            "priority": PRIORITY_PROPERTY,
+            "preempt": PREEMPT_PROPERTY
+        },
+        "required": []
+    },
+    builder=build_script_operation
+)
+def run_script(steps: list = None, name: str = None, save_as: str = None, run: bool = True, robot_id: str = None,
+               priority: str = DEFAULT_PRIORITY, preempt: bool = False):
+    """Compile a script (or fetch a stored one) and queue it as one ScriptOperation.
+    
+    Parameter Rules:
+    - steps or name (not both): inline script, or name of a stored script
+    - save_as: store the inline steps, compiled, under this name
+    - run=False: only store (with save_as)
+    """
+    plan, descriptions = _script_plan(steps, name)
+    if save_as:
+        if steps is None:
+            raise ValueError("save_as stores new steps: give the script steps")
+        script_store.put(save_as, steps, plan, descriptions)
+        logger.info("Stored script %s", save_as, extra={"steps": len(plan)})
+    
+    label = save_as or name
+    if not run:
+        if not save_as:
+            raise ValueError("run=false only makes sense with save_as")
+        from mcp.types import TextContent
+        return [TextContent(type="text", text=f"Stored script '{save_as}' ({_describe_script(descriptions)})")]
+    
+    operation = _script_operation(plan, label)
+    message = f"Queued script{f' {label!r}' if label else ''} ({_describe_script(descriptions)})"
+    return queue_operation(operation, message, robot_id, priority, preempt)
+
+
+@register_tool(
+    "list_scripts",
+    description="List the scripts stored with run_script(save_as=...), with their steps. Run one with run_script(name=...).",
+    input_schema={
+        "type": "object",
+        "properties": {},
+        "required": []
+    }
+)
+def list_scripts():
+    """List stored scripts and what they do."""
+    from mcp.types import TextContent
+    names = script_store.names()
+    if not names:
+        return [TextContent(type="text", text="No stored scripts. Store one with run_script(steps=..., save_as='name').")]
+    
+    lines = []
+    for name in names:
+        try:
+            _, descriptions = _script_plan(name=name)
+            lines.append(f"- {name}: {_describe_script(descriptions)}")
+        except ValueError as e:
+            lines.append(f"- {name}: invalid ({e})")
+    return [TextContent(type="text", text="Stored scripts:\n" + "\n".join(lines))]
 
 
-TOOL_HANDLERS = {
-    "move_buddy": move_buddy,
-    "rotate_buddy": rotate_buddy,
-    "speak": speak,
-    "move_head": move_head,
-    "set_mood": set_mood,
-    "take_picture": take_picture,
-    "multi_action": multi_action,
-}
+# --- Tool dispatch dictionary ---
+# Derived from the registry, kept for callers that only need name -> handler.
 
+TOOL_HANDLERS = {name: spec.handler for name, spec in TOOLS.items()}
 
 
 # --- CLI support (used by api.py) ---
 
 def build_operation(name: str, **kwargs) -> dict:
     """Build an operation dict for a given tool name and arguments."""
-    if name == "move_buddy":
-        return {"type": "MoveOperation", "speed": kwargs["speed"], "distance": kwargs["distance"]}
-    elif name == "rotate_buddy":
-        return {"type": "RotateOperation", "speed": kwargs["speed"], "angle": kwargs["angle"]}
-    elif name == "speak":
-        return {"type": "TalkOperation", "message": kwargs["message"], "volume": kwargs.get("volume", 300)}
-    elif name == "move_head":
-        axis_value = "Yes" if kwargs["axis"].lower() == "yes" else "No"
-        return {"type": "HeadOperation", "speed": kwargs.get("speed", 40.0), "angle": kwargs.get("angle", 20.0), "axis": axis_value}
-    elif name == "set_mood":
-        return {"type": "MoodOperation", "mood": kwargs["mood"].upper()}
-    else:
+    spec = TOOLS.get(name)
+    if spec is None or spec.builder is None:
         return None
-
+    return spec.builder(**kwargs)
@@ -0,0 +1,118 @@
+"""
+Logging shared by the Flask API, the MCP server and the background workers.
+
+Log calls only put the record on an in-memory queue (QueueHandler); a single
+listener thread formats it and writes it to stderr. A log call on the
+/operation hot path therefore never waits on terminal or pipe I/O, and a
+message below the configured level costs a level check and nothing more
+(use %-style arguments, not f-strings, so formatting is skipped too).
+stdout is never written to: it is reserved for the MCP stdio protocol.
+
+Records are structured: pass context as `extra={...}` and it is appended as
+key=value pairs (text) or as fields of a JSON object (json).
+
+Configured through environment variables:
+- BUDDY_LOG_LEVEL: DEBUG, INFO (default), WARNING or ERROR
+- BUDDY_LOG_FORMAT: text (default) or json (one object per line)
+- BUDDY_LOG_IDLE_POLL_EVERY: at INFO, log one in N empty /operation polls (default 100)
+"""
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+LOG_LEVEL = os.environ.get("BUDDY_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("BUDDY_LOG_FORMAT", "text").lower()
+IDLE_POLL_LOG_EVERY = max(int(os.environ.get("BUDDY_LOG_IDLE_POLL_EVERY", "100")), 1)
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger of a Buddy component (child of the "buddy" logger)."""
+    return logging.getLogger(f"buddy.{name}")
+
+
+def _extra_fields(record) -> dict:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+
+class TextFormatter(logging.Formatter):
+    """`time level logger message key=value ...`"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the `extra` fields at top level."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_extra_fields(record),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock prepare() formats the message in the calling thread, which is
+    exactly the work we want off the request path.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class Sampler:
+    """Lets one call in `every` through, e.g. to log a repetitive message."""
+
+    def __init__(self, every: int):
+        self.every = every
+        self._calls = itertools.count()
+
+    def __call__(self) -> bool:
+        return next(self._calls) % self.every == 0
+
+
+def setup_logging():
+    """Route all logging through the queue to stderr. Safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+    # Flush what is still queued when the process exits
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    root.setLevel(logging.WARNING)
+    logging.getLogger("buddy").setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
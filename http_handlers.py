@@ -0,0 +1,173 @@
+"""
+Framework-independent parts of the HTTP endpoints.
+
+The Flask app (api.py) and the async server (asgi_server.py) parse requests
+their own way and then call these helpers, so both modes log the same lines
+and answer with the same bodies.
+"""
+import base64
+import json
+import logging
+import math
+import os
+import time
+
+from buddy_logging import IDLE_POLL_LOG_EVERY, Sampler, get_logger
+
+# Upper bound (seconds) for the ?wait= long-poll parameter of /operation
+MAX_POLL_WAIT = 30.0
+
+# Interval (seconds) between keep-alive comments on the /operation/stream push channel
+STREAM_HEARTBEAT = 15.0
+
+# Lease (seconds) of operations pushed on /operation/stream without ?lease=
+STREAM_LEASE = float(os.environ.get("BUDDY_STREAM_LEASE", "30"))
+
+OWNER_ONLY_ERROR = {
+    "error": "NotFound",
+    "message": "Disponible uniquement sur le serveur principal (api.py), pas sur les workers HTTP."
+}
+INVALID_ROBOT_ERROR = {
+    "error": "InvalidParameter",
+    "message": "Identifiant de robot invalide (lettres, chiffres, '-' et '_', 32 caractères max)."
+}
+UNKNOWN_ROBOT_ERROR = {
+    "error": "NotFound",
+    "message": "Robot inconnu : un robot est créé par son premier appel à /operation ou /upload_image."
+}
+INVALID_BATCH_ERROR = {
+    "error": "InvalidParameter",
+    "message": "Le paramètre 'max' doit être un entier supérieur ou égal à 1."
+}
+INVALID_LEASE_ERROR = {
+    "error": "InvalidParameter",
+    "message": "Le paramètre 'lease' doit être un nombre de secondes positif."
+}
+MISSING_BODY_ERROR = {
+    "error": "MissingParameter",
+    "message": "Le corps de la requête (image binaire) est requis."
+}
+UPLOAD_SUCCESS = {
+    "status": "success",
+    "message": "Image reçue avec succès"
+}
+
+logger = get_logger("api")
+
+# Empty polls are the bulk of /operation traffic: only log one in IDLE_POLL_LOG_EVERY
+idle_poll_sampled = Sampler(IDLE_POLL_LOG_EVERY)
+
+
+def decode_image_payload(data):
+    """Image bytes of an /upload_image JSON payload.
+    
+    Returns (image_bytes, None), or (None, error body) for a 400 response.
+    """
+    if not isinstance(data, dict) or 'image_base64' not in data:
+        return None, {
+            "error": "MissingParameter",
+            "message": "Le paramètre 'image' (base64) est requis."
+        }
+    try:
+        # Strict decoding, line breaks of MIME-style encoders aside
+        image_bytes = base64.b64decode("".join(data['image_base64'].split()), validate=True)
+    except Exception as e:
+        logger.warning("Error decoding image: %s", e)
+        return None, {
+            "error": "InvalidParameter",
+            "message": "Le paramètre 'image' n'est pas un base64 valide."
+        }
+    if not image_bytes:
+        # Same answer as an empty /upload_image/raw body
+        return None, MISSING_BODY_ERROR
+    return image_bytes, None
+
+
+def valid_lease(lease) -> bool:
+    """?lease= is optional; when given it must be a finite, positive number of seconds."""
+    return lease is None or (math.isfinite(lease) and lease > 0)
+
+
+def poll_result(robot, ops: list, batch_size: int = None) -> dict:
+    """Log a /operation poll and build its response body."""
+    if ops:
+        logger.info("[/operation] Returning %d operation(s)", len(ops),
+                    extra={"robot": robot.id, "ids": [op["id"] for op in ops]})
+    elif logger.isEnabledFor(logging.DEBUG) or idle_poll_sampled():
+        logger.info("[/operation] No operations in queue", extra={"robot": robot.id, "sampling": IDLE_POLL_LOG_EVERY})
+    
+    if batch_size is not None:
+        return {"status": "success", "operations": ops}
+    return {"status": "success", "operation": ops[0] if ops else None}
+
+
+def _parse_duration(data):
+    """Duration (seconds, or None) of an ack JSON body; ValueError if the body or the duration is invalid."""
+    if data is None:
+        return None
+    if not isinstance(data, dict):
+        raise ValueError("body is not a JSON object")
+    duration = data.get("duration")
+    if duration is None:
+        return None
+    if isinstance(duration, bool):
+        raise ValueError("duration is a boolean")
+    duration = float(duration)  # Raises ValueError/TypeError for anything else than a number
+    if not math.isfinite(duration) or duration < 0:
+        raise ValueError(f"invalid duration: {duration}")
+    return duration
+
+
+def ack_result(robot, op_id: str, data) -> tuple:
+    """Acknowledge an operation and complete its trace. Returns (body, status code).
+    
+    data is the JSON body of the request (None when absent or not JSON).
+    """
+    try:
+        duration = _parse_duration(data)
+    except (TypeError, ValueError):
+        return {
+            "error": "InvalidParameter",
+            "message": "Le corps doit être un objet JSON dont le champ 'duration' est un nombre de secondes positif."
+        }, 400
+    result = robot.operation_queue.ack(op_id, duration)
+    
+    if result == "unknown":
+        return {
+            "error": "NotFound",
+            "message": f"Aucune opération en attente d'acquittement avec l'id '{op_id}'."
+        }, 404
+    return {"status": "success", "result": result}, 200
+
+
+class StreamDeliveries:
+    """Operations pushed on one /operation/stream connection and not acknowledged yet.
+    
+    Pushed operations are always leased (?lease=, STREAM_LEASE by default):
+    a dropped connection is only noticed on a later write, so the operation
+    that wakes a stale stream would otherwise be lost. When the stream closes,
+    release() puts its unacknowledged operations back in the queue for the
+    next poll or stream.
+    """
+    
+    def __init__(self, robot, lease: float = None):
+        self.robot = robot
+        self.lease = lease or STREAM_LEASE
+        self._deadlines = {}  # op id -> lease deadline
+    
+    def pushed(self, op: dict):
+        now = time.monotonic()
+        # Past their deadline the queue redelivers them anyway
+        self._deadlines = {op_id: deadline for op_id, deadline in self._deadlines.items() if deadline > now}
+        self._deadlines[op["id"]] = now + self.lease
+    
+    def release(self):
+        if self._deadlines:
+            self.robot.operation_queue.release(list(self._deadlines))
+            self._deadlines.clear()
+
+
+def stream_event(robot, op: dict) -> str:
+    """Server-sent event pushing one operation on /operation/stream."""
+    logger.info("[/operation/stream] Pushing operation %s", op["id"], extra={"robot": robot.id})
+    return f"event: operation\ndata: {json.dumps(op)}\n\n"
@@ -0,0 +1,54 @@
+"""
+Serve the HTTP API from several worker processes sharing the MCP process's state.
+
+The MCP process (api.py) stays the owner of every queue and frame cache and
+exposes them through the state broker (see state_broker.py). Each worker
+process runs the async server of asgi_server.py on its own core: polls and
+acks go to the owner's queues, uploaded frames are processed locally.
+
+Usage (same BUDDY_BROKER_ADDRESS for both):
+    BUDDY_BROKER_ADDRESS=/tmp/buddy.sock python api.py
+    BUDDY_BROKER_ADDRESS=/tmp/buddy.sock python http_workers.py --workers 4 --port 5001
+
+Point the robots at the workers' port. api.py keeps serving port 5000 itself.
+"""
+import argparse
+import os
+
+import uvicorn
+
+from http_handlers import MAX_POLL_WAIT
+from state_broker import BROKER_ADDRESS, BROKER_AUTHKEY, WORKER_ENV, parse_address
+
+
+def create_app():
+    """ASGI app of one worker process (uvicorn app factory)."""
+    from buddy_logging import setup_logging
+    setup_logging()
+
+    # api builds its registry from WORKER_ENV: a proxy to the owner's state
+    import api
+    from asgi_server import build_app
+    return build_app(api.app, api.robots, owner=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Buddy HTTP worker processes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5001)
+    args = parser.parse_args()
+
+    if not BROKER_ADDRESS:
+        parser.error("BUDDY_BROKER_ADDRESS must be set (and the MCP process started with it)")
+    if isinstance(parse_address(BROKER_ADDRESS), tuple) and not BROKER_AUTHKEY:
+        parser.error("BUDDY_BROKER_AUTHKEY must be set for a host:port broker address")
+
+    # Inherited by the worker processes
+    os.environ[WORKER_ENV] = "1"
+    uvicorn.run("http_workers:create_app", factory=True, host=args.host, port=args.port, workers=args.workers,
+                log_config=None, access_log=False, timeout_keep_alive=int(MAX_POLL_WAIT) + 5)
+
+
+if __name__ == '__main__':
+    main()
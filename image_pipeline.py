@@ -0,0 +1,449 @@
+"""
+Background processing pipeline for camera frames uploaded by Buddy.
+
+Each robot has its own ImagePipeline (frame cache, history, stream). Flask
+handlers only hand the encoded frame to ImagePipeline.submit_frame() and
+return. A worker pool shared by all robots does the decode / resize / encode
+off the request thread. Frames are latest-wins per robot: a frame still
+waiting when a newer one arrives is dropped, and a slow worker can never
+publish over a newer frame.
+
+Output encoding is configured through environment variables (e.g. in the
+"env" section of claude_desktop_config.json):
+- BUDDY_IMAGE_FORMAT: png (default), jpeg or webp
+- BUDDY_IMAGE_QUALITY: 1-100 quality for jpeg/webp (default 80)
+- BUDDY_IMAGE_SIZE: a preset (small, medium, large, original) or WIDTHxHEIGHT
+
+The last processed frames are also kept in a bounded history (see
+FRAME_HISTORY_SIZE / FRAME_HISTORY_MAX_BYTES) so tools can look back in time,
+and fanned out as JPEG to live MJPEG viewers (see iter_stream_frames()).
+
+BUDDY_IMAGE_WORKERS sets the size of the shared worker pool.
+"""
+import os
+import base64
+import threading
+import tempfile
+import time
+from collections import deque
+from datetime import datetime
+from io import BytesIO
+from PIL import Image, ImageChops, ImageStat
+from buddy_logging import get_logger
+from metrics import FRAMES_PROCESSED, IMAGE_STAGE_SECONDS
+
+# Supported output codecs: name -> (PIL format, mime type, file extension)
+IMAGE_FORMATS = {
+    "png": ("PNG", "image/png", ".png"),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+    "webp": ("WEBP", "image/webp", ".webp"),
+}
+
+# Downscale presets for BUDDY_IMAGE_SIZE ("original" keeps the uploaded size)
+IMAGE_SIZE_PRESETS = {
+    "small": (320, 240),
+    "medium": (640, 480),
+    "large": (800, 600),
+    "original": None,
+}
+
+
+def parse_image_size(value: str):
+    """Parse a BUDDY_IMAGE_SIZE value: a preset name or WIDTHxHEIGHT.
+
+    Raises ValueError for anything else.
+    """
+    value = value.strip().lower()
+    if value in IMAGE_SIZE_PRESETS:
+        return IMAGE_SIZE_PRESETS[value]
+    try:
+        width, height = (int(part) for part in value.split("x"))
+    except ValueError:
+        width = height = 0
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Invalid BUDDY_IMAGE_SIZE: {value!r} "
+                         f"(expected one of {', '.join(IMAGE_SIZE_PRESETS)} or WIDTHxHEIGHT)")
+    return (width, height)
+
+
+IMAGE_FORMAT = os.environ.get("BUDDY_IMAGE_FORMAT", "png").lower()
+if IMAGE_FORMAT == "jpg":
+    IMAGE_FORMAT = "jpeg"
+if IMAGE_FORMAT not in IMAGE_FORMATS:
+    raise ValueError(f"Unsupported BUDDY_IMAGE_FORMAT: {IMAGE_FORMAT} (expected one of {', '.join(IMAGE_FORMATS)})")
+PIL_FORMAT, IMAGE_MIME_TYPE, IMAGE_EXTENSION = IMAGE_FORMATS[IMAGE_FORMAT]
+
+# Encoder quality for lossy formats (ignored for PNG)
+try:
+    IMAGE_QUALITY = int(os.environ.get("BUDDY_IMAGE_QUALITY", "80"))
+except ValueError:
+    IMAGE_QUALITY = None
+if IMAGE_QUALITY is None or not 1 <= IMAGE_QUALITY <= 100:
+    raise ValueError(f"Invalid BUDDY_IMAGE_QUALITY: {os.environ['BUDDY_IMAGE_QUALITY']!r} (expected an integer from 1 to 100)")
+
+# Target image size (None = keep the uploaded size)
+IMAGE_SIZE = parse_image_size(os.environ.get("BUDDY_IMAGE_SIZE", "large"))
+
+# Path to save the latest image (of the default robot, see latest_image_path())
+LATEST_IMAGE_PATH = os.path.join(os.path.dirname(__file__), "latest_image" + IMAGE_EXTENSION)
+
+# Number of worker threads decoding/encoding frames, shared by all robots
+IMAGE_WORKERS = int(os.environ.get("BUDDY_IMAGE_WORKERS", "2"))
+
+# Frame history bounds: at most N frames and at most this many bytes (encoded + base64)
+FRAME_HISTORY_SIZE = int(os.environ.get("BUDDY_FRAME_HISTORY", "10"))
+FRAME_HISTORY_MAX_BYTES = int(os.environ.get("BUDDY_FRAME_HISTORY_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Change detection: frames whose grayscale thumbnail differs from the last
+# published one by less than this mean absolute difference (0-255 scale) are
+# treated as duplicates and skip resize/encode. 0 disables the check.
+CHANGE_THRESHOLD = float(os.environ.get("BUDDY_CHANGE_THRESHOLD", "2.0"))
+SIGNATURE_SIZE = (32, 24)
+
+# Seconds after which an MJPEG viewer is re-sent the current frame when nothing
+# new arrived (keeps proxies happy and detects closed connections)
+STREAM_KEEPALIVE = 5.0
+
+
+logger = get_logger("image_pipeline")
+
+
+# Shared worker pool: pipelines with a pending frame, oldest first
+_ready = deque()
+_ready_cond = threading.Condition()
+_workers = []
+
+
+def latest_image_path(robot_id: str = None) -> str:
+    """Where the latest frame of a robot is written (LATEST_IMAGE_PATH for the default robot)."""
+    if robot_id is None:
+        return LATEST_IMAGE_PATH
+    root, extension = os.path.splitext(LATEST_IMAGE_PATH)
+    return f"{root}_{robot_id}{extension}"
+
+
+def frame_size(frame: dict) -> int:
+    """Approximate memory held by a frame entry."""
+    return len(frame["bytes"]) + len(frame["base64"])
+
+
+def _ensure_workers():
+    with _ready_cond:
+        while len(_workers) < max(IMAGE_WORKERS, 1):
+            worker = threading.Thread(target=_worker_loop, name=f"image-worker-{len(_workers)}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+def _worker_loop():
+    while True:
+        with _ready_cond:
+            _ready_cond.wait_for(lambda: _ready)
+            pipeline = _ready.popleft()
+            seq, image_bytes, received_at = pipeline._pending
+            pipeline._pending = None
+
+        try:
+            pipeline.process_frame(seq, image_bytes, received_at)
+        except Exception:
+            logger.exception("Error processing frame #%d of %s", seq, pipeline.name)
+
+
+def decode_image(image_bytes: bytes):
+    """Decode an uploaded frame, decoding JPEGs directly at roughly IMAGE_SIZE."""
+    img = Image.open(BytesIO(image_bytes))
+    if IMAGE_SIZE is not None:
+        # Let the JPEG decoder downscale while decoding (no-op for other formats)
+        img.draft("RGB", IMAGE_SIZE)
+    # Image.open() only reads the header: decode now, so the time lands in the decode stage
+    img.load()
+    return img
+
+
+def frame_signature(img):
+    """Tiny grayscale thumbnail used to detect near-duplicate frames."""
+    return img.convert("L").resize(SIGNATURE_SIZE, Image.Resampling.BOX)
+
+
+def signature_distance(a, b) -> float:
+    """Mean absolute pixel difference between two frame signatures (0-255)."""
+    return ImageStat.Stat(ImageChops.difference(a, b)).mean[0]
+
+
+def resize_image(img):
+    """Resize a decoded image to IMAGE_SIZE (if a target size is configured)."""
+    if IMAGE_SIZE is None:
+        return img
+    return img.resize(IMAGE_SIZE, Image.Resampling.LANCZOS)
+
+
+def encode_image(img, pil_format: str = PIL_FORMAT) -> bytes:
+    """Encode an image with the given codec (the configured one by default)."""
+    options = {}
+    if pil_format == "JPEG":
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        options = {"quality": IMAGE_QUALITY, "optimize": False}
+    elif pil_format == "WEBP":
+        options = {"quality": IMAGE_QUALITY, "method": 0}
+
+    buffer = BytesIO()
+    img.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+class ImagePipeline:
+    """Frame cache, history and live stream of one robot.
+
+    latest_image, frame_history and lock are owned by the robot state; the
+    lock is the robot's queue lock, held only while publishing a frame.
+
+    image_path None skips the latest image file. on_publish, if given, is
+    called with (encoded bytes, mime type, received_at) for every published
+    frame, and on_touch with received_at for every unchanged one (used by
+    HTTP worker processes, see state_broker.py).
+    """
+
+    def __init__(self, name: str, latest_image: dict, frame_history, lock, image_path: str = LATEST_IMAGE_PATH,
+                 on_publish=None, on_touch=None):
+        self.name = name
+        self.latest_image = latest_image
+        self.frame_history = frame_history
+        self.lock = lock
+        self.image_path = image_path
+        self.on_publish = on_publish
+        self.on_touch = on_touch
+
+        # Pending slot: (seq, image_bytes, received_at) of the newest unprocessed frame,
+        # guarded by the shared _ready_cond
+        self._pending = None
+        self._submitted_seq = 0
+        self._published_seq = 0
+        self._publish_lock = threading.Lock()
+        self._last_signature = None
+        self._last_remote_at = ""  # received_at of the newest frame from publish_remote_frame()
+
+        # MJPEG live stream: newest (seq, jpeg bytes), encoded once and shared by all viewers
+        self._stream_frame = (0, None)
+        self._stream_cond = threading.Condition()
+        self._stream_viewers = 0
+
+    def submit_frame(self, image_bytes: bytes) -> int:
+        """Queue an encoded frame for processing and return its sequence number.
+
+        Never blocks on image work. If the previous frame hasn't been picked up
+        by a worker yet it is replaced (latest-wins).
+        """
+        _ensure_workers()
+        with _ready_cond:
+            self._submitted_seq += 1
+            if self._pending is not None:
+                logger.debug("Dropping stale frame #%d of %s", self._pending[0], self.name)
+                FRAMES_PROCESSED.inc("dropped")
+            else:
+                _ready.append(self)
+            self._pending = (self._submitted_seq, image_bytes, datetime.now().isoformat())
+            _ready_cond.notify()
+            return self._submitted_seq
+
+    def process_frame(self, seq: int, image_bytes: bytes, received_at: str):
+        """Decode, resize and encode one frame, then publish it as the latest image.
+
+        The frame is encoded once. The same bytes are written to image_path
+        and cached in latest_image together with their base64 form, so readers
+        never touch the disk or re-encode.
+
+        Frames that look the same as the last published one (see CHANGE_THRESHOLD)
+        are not resized or encoded: the cached frame is kept and only its
+        timestamp is refreshed.
+        """
+        started = time.perf_counter()
+        img = decode_image(image_bytes)
+        decoded = time.perf_counter()
+        IMAGE_STAGE_SECONDS.observe(decoded - started, "decode")
+        signature = frame_signature(img)
+        IMAGE_STAGE_SECONDS.observe(time.perf_counter() - decoded, "signature")
+
+        with self._publish_lock:
+            if seq < self._published_seq:
+                logger.debug("Discarding frame #%d of %s, newer frame #%d already published", seq, self.name, self._published_seq)
+                FRAMES_PROCESSED.inc("superseded")
+                return
+            unchanged = (CHANGE_THRESHOLD > 0 and self._last_signature is not None
+                         and signature_distance(signature, self._last_signature) < CHANGE_THRESHOLD)
+            if unchanged:
+                self._published_seq = seq
+                self._touch_frame(received_at)
+                FRAMES_PROCESSED.inc("unchanged")
+        if unchanged:
+            # Outside the lock: in worker processes this is a call to the owner
+            if self.on_touch is not None:
+                self.on_touch(received_at)
+            return
+
+        started = time.perf_counter()
+        img = resize_image(img)
+        resized = time.perf_counter()
+        IMAGE_STAGE_SECONDS.observe(resized - started, "resize")
+        encoded = encode_image(img)
+        IMAGE_STAGE_SECONDS.observe(time.perf_counter() - resized, "encode")
+        encoded_base64 = base64.b64encode(encoded).decode('ascii')
+
+        tmp_path = self._write_temp_file(encoded)
+        try:
+            with self._publish_lock:
+                if seq < self._published_seq:
+                    logger.debug("Discarding frame #%d of %s, newer frame #%d already published", seq, self.name, self._published_seq)
+                    FRAMES_PROCESSED.inc("superseded")
+                    return
+                self._published_seq = seq
+                self._last_signature = signature
+                version = self._store_frame(encoded, encoded_base64, IMAGE_MIME_TYPE, received_at, tmp_path)
+                FRAMES_PROCESSED.inc("published")
+        finally:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        if self.on_publish is not None:
+            self.on_publish(encoded, IMAGE_MIME_TYPE, received_at)
+
+        # Feed MJPEG viewers. Only pay for an extra JPEG encode when someone is watching.
+        if PIL_FORMAT == "JPEG":
+            self.publish_stream_frame(version, encoded)
+        elif self._stream_viewers:
+            self.publish_stream_frame(version, encode_image(img, "JPEG"))
+
+    def _touch_frame(self, received_at: str):
+        """Refresh the timestamp of the cached frame (the scene didn't change)."""
+        with self.lock:
+            self.latest_image["timestamp"] = received_at
+            if self.frame_history:
+                self.frame_history[-1]["timestamp"] = received_at
+
+    def touch_remote_frame(self, received_at: str):
+        """Refresh the timestamp for an unchanged frame seen by an HTTP worker process."""
+        with self._publish_lock:
+            if received_at < self._last_remote_at:
+                return
+            self._last_remote_at = received_at
+            self._touch_frame(received_at)
+        FRAMES_PROCESSED.inc("unchanged")
+
+    def publish_remote_frame(self, encoded: bytes, mime_type: str, received_at: str):
+        """Publish a frame already processed by an HTTP worker process (see state_broker.py).
+
+        Frames received before the newest published one are ignored.
+        """
+        encoded_base64 = base64.b64encode(encoded).decode('ascii')
+        tmp_path = self._write_temp_file(encoded)
+        try:
+            with self._publish_lock:
+                if received_at < self._last_remote_at:
+                    FRAMES_PROCESSED.inc("superseded")
+                    return
+                self._last_remote_at = received_at
+                version = self._store_frame(encoded, encoded_base64, mime_type, received_at, tmp_path)
+                FRAMES_PROCESSED.inc("published")
+        finally:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        if mime_type == "image/jpeg":
+            self.publish_stream_frame(version, encoded)
+        elif self._stream_viewers:
+            self.publish_stream_frame(version, encode_image(Image.open(BytesIO(encoded)), "JPEG"))
+
+    def _write_temp_file(self, encoded: bytes):
+        """Write a frame next to image_path so the final os.replace() is atomic. Returns the temp path or None."""
+        if self.image_path is None:
+            return None
+        fd, tmp_path = tempfile.mkstemp(suffix=IMAGE_EXTENSION, dir=os.path.dirname(self.image_path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(encoded)
+        return tmp_path
+
+    def _store_frame(self, encoded: bytes, encoded_base64: str, mime_type: str, received_at: str, tmp_path) -> int:
+        """Make an encoded frame the latest image and return its version.
+
+        Moves tmp_path to image_path, then updates the in-memory cache used by
+        take_picture and the CLI and the frame history. Must be called with
+        _publish_lock held.
+        """
+        if tmp_path is not None:
+            os.replace(tmp_path, self.image_path)
+        with self.lock:
+            version = self.latest_image.get("version", 0) + 1
+            frame = {
+                "seq": version,
+                "timestamp": received_at,
+                "bytes": encoded,
+                "base64": encoded_base64,
+                "mime_type": mime_type,
+            }
+            self.latest_image.update({
+                "bytes": encoded,
+                "base64": encoded_base64,
+                "mime_type": mime_type,
+                "version": version,
+                "timestamp": received_at,
+            })
+            self.frame_history.append(frame)
+            self._trim_history()
+        return version
+
+    def _trim_history(self):
+        """Evict the oldest frames until the history fits in FRAME_HISTORY_MAX_BYTES.
+
+        The newest frame is always kept. Must be called with the lock held.
+        """
+        total = sum(frame_size(frame) for frame in self.frame_history)
+        while len(self.frame_history) > 1 and total > FRAME_HISTORY_MAX_BYTES:
+            total -= frame_size(self.frame_history.popleft())
+
+    def publish_stream_frame(self, seq: int, jpeg: bytes):
+        """Make a JPEG frame the current MJPEG frame and wake up all viewers."""
+        with self._stream_cond:
+            if seq > self._stream_frame[0]:
+                self._stream_frame = (seq, jpeg)
+                self._stream_cond.notify_all()
+
+    def iter_stream_frames(self):
+        """Yield JPEG frames for one MJPEG viewer until the viewer disconnects.
+
+        Every viewer reads the same shared frame, so each frame is encoded once
+        whatever the number of viewers. A slow viewer never queues anything: when
+        it comes back for the next frame it simply gets the newest one.
+        """
+        with self._stream_cond:
+            self._stream_viewers += 1
+        try:
+            self._refresh_stream_frame()
+            last_seq = None
+            while True:
+                with self._stream_cond:
+                    self._stream_cond.wait_for(
+                        lambda: self._stream_frame[1] is not None and self._stream_frame[0] != last_seq,
+                        timeout=STREAM_KEEPALIVE)
+                    seq, jpeg = self._stream_frame
+                if jpeg is not None:
+                    last_seq = seq
+                    yield jpeg
+        finally:
+            with self._stream_cond:
+                self._stream_viewers -= 1
+
+    def _refresh_stream_frame(self):
+        """Build the stream frame from the cached latest image if it is missing or stale.
+
+        Needed when the output codec isn't JPEG and nobody was watching when the
+        current frame was published (e.g. a static scene and a new viewer).
+        """
+        with self.lock:
+            version = self.latest_image.get("version", 0)
+            encoded = self.latest_image.get("bytes")
+        if encoded is None or self._stream_frame[0] >= version:
+            return
+        if PIL_FORMAT == "JPEG":
+            self.publish_stream_frame(version, encoded)
+        else:
+            self.publish_stream_frame(version, encode_image(Image.open(BytesIO(encoded)), "JPEG"))
@@ -11,24 +11,21 @@ Architecture:
 """
 
 import asyncio
-import sys
-import threading
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from mcp.server import Server
 from mcp.server.stdio import stdio_server
-from mcp.types import Tool, TextContent
+from mcp.types import InitializedNotification, Tool, TextContent
 
-# Import Buddy functions
-from buddy_functions import (
-    init_shared_state,
-    move_buddy,
-    rotate_buddy,
-    speak,
-    move_head,
-    set_mood,
-    take_picture,
-    multi_action,
-    TOOL_HANDLERS
-)
+# Import Buddy functions (importing the module registers all tools)
+from buddy_functions import shared_state_error, state_ready
+from buddy_logging import get_logger, setup_logging
+from metrics import TOOL_CALL_SECONDS
+import tracing
+from tool_registry import TOOLS, list_tool_definitions
 
 
 # Shared state - These will be initialized by api.py via init_shared_state()
@@ -36,250 +33,127 @@ from buddy_functions import (
 # The queue created in api.py is the single source of truth.
 
 
-def log(msg):
-    """Log messages to stderr (stdout is reserved for MCP protocol)"""
-    print(f"[MCP Server] {msg}", file=sys.stderr)
+# Logs go to stderr (stdout is reserved for MCP protocol), see buddy_logging.py
+logger = get_logger("mcp_server")
 
 
 # Create MCP server instance
 app = Server("buddy-mcp-server")
 
+# Tool handlers are blocking (locks, image data), so they run on a thread pool
+# to keep the stdio event loop free. BUDDY_TOOL_WORKERS=0 runs everything inline.
+TOOL_WORKERS = int(os.environ.get("BUDDY_TOOL_WORKERS", "4"))
+tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="mcp-tool") if TOOL_WORKERS > 0 else None
+
+# Tools that only build an operation and append it to the queue. The lock is
+# held for microseconds, so a thread hop would cost more than it saves.
+INLINE_TOOLS = {"move_buddy", "rotate_buddy", "speak", "move_head", "set_mood", "multi_action"}
+
+# Max seconds a tool call waits for the robot registry while the HTTP side is
+# still loading in the background (see startup.py)
+STATE_READY_TIMEOUT = 30.0
+
 
 @app.list_tools()
 async def list_tools() -> list[Tool]:
     """
     List all available tools for controlling Buddy.
     Claude Desktop will call this to discover available capabilities.
+    The Tool objects are built once from the registry in buddy_functions.py.
     """
-    log("Listing available tools")
-    return [
-        Tool(
-            name="move_buddy",
-            description="Move Buddy forward or backward. IMPORTANT: Speed must always be positive. Direction is controlled by distance sign (+ forward, - backward). Example: move_buddy(speed=100, distance=-0.5) moves backward.",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "speed": {
-                        "type": "number",
-                        "description": "Movement speed - MUST be positive (recommended: 50-200). Direction is NOT determined by speed.",
-                        "minimum": 0,
-                        "maximum": 500
-                    },
-                    "distance": {
-                        "type": "number",
-                        "description": "Distance to move in meters. POSITIVE = forward, NEGATIVE = backward. Example: 0.5 moves forward, -0.5 moves backward.",
-                    }
-                },
-                "required": ["speed", "distance"]
-            }
-        ),
-        Tool(
-            name="rotate_buddy",
-            description="Rotate Buddy left or right. IMPORTANT: Speed must always be positive. Direction is controlled by angle sign (+ right, - left). Example: rotate_buddy(speed=50, angle=-90) rotates left.",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "speed": {
-                        "type": "number",
-                        "description": "Rotation speed - MUST be positive (recommended: 50-200). Direction is NOT determined by speed.",
-                        "minimum": 0,
-                        "maximum": 500
-                    },
-                    "angle": {
-                        "type": "number",
-                        "description": "Angle to rotate in degrees. POSITIVE = turn right, NEGATIVE = turn left. Example: 90 turns right, -90 turns left.",
-                    }
-                },
-                "required": ["speed", "angle"]
-            }
-        ),
-        Tool(
-            name="speak",
-            description="Make Buddy say something out loud. Use this for standalone speech. If you want Buddy to talk WHILE doing something else (moving, rotating), use multi_action instead. Perfect for greetings, announcements, or any verbal communication.",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "message": {
-                        "type": "string",
-                        "description": "The text that Buddy should speak"
-                    },
-                    "volume": {
-                        "type": "integer",
-                        "description": "Volume level (100-500, default: 300)",
-                        "minimum": 100,
-                        "maximum": 500,
-                        "default": 300
-                    }
-                },
-                "required": ["message"]
-            }
-        ),
-        Tool(
-            name="move_head",
-            description="Make Buddy nod (yes) or shake (no) his head. Use 'yes' for agreement/approval or 'no' for disagreement/disapproval. Can be combined with other actions using multi_action (e.g., nod while saying 'Yes!')",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "axis": {
-                        "type": "string",
-                        "description": "Head movement type",
-                        "enum": ["yes", "no"]
-                    },
-                    "speed": {
-                        "type": "number",
-                        "description": "Movement speed (default: 40.0)",
-                        "minimum": 0,
-                        "maximum": 100,
-                        "default": 40.0
-                    },
-                    "angle": {
-                        "type": "number",
-                        "description": "Movement angle (default: 20.0)",
-                        "minimum": 0,
-                        "maximum": 90,
-                        "default": 20.0
-                    }
-                },
-                "required": ["axis"]
-            }
-        ),
-        Tool(
-            name="set_mood",
-            description="Change Buddy's facial expression/mood displayed on the screen. Use this to convey emotions visually. Can be combined with speech and gestures using multi_action for more expressive interactions (e.g., smile while saying 'Hello!')",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "mood": {
-                        "type": "string",
-                        "description": "The mood/expression to display",
-                        "enum": ["happy", "sad", "angry", "surprised", "neutral", "afraid", "disgusted", "contempt"]
-                    }
-                },
-                "required": ["mood"]
-            }
-        ),
-        Tool(
-            name="take_picture",
-            description="Capture and return the latest image from Buddy's camera. Returns the image with timestamp. Use this to see what Buddy sees, analyze the environment, or track a person.",
-            inputSchema={
-                "type": "object",
-                "properties": {},
-                "required": []
-            }
-        ),
-        Tool(
-            name="multi_action",
-            description="Execute multiple actions SIMULTANEOUSLY. This makes Buddy more fluid and natural by doing several things at once. Examples: move while talking, rotate while speaking, greet someone (talk + nod + smile). Use this instead of calling individual tools sequentially when you want Buddy to multitask.",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "actions": {
-                        "type": "array",
-                        "description": "List of actions to execute simultaneously. Each action has a 'type' and its specific parameters.",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "type": {
-                                    "type": "string",
-                                    "description": "Type of action: 'move' (move forward/backward), 'rotate' (turn left/right), 'talk' (speak), 'head' (nod/shake), 'mood' (facial expression)",
-                                    "enum": ["move", "rotate", "talk", "head", "mood"]
-                                },
-                                "speed": {
-                                    "type": "number",
-                                    "description": "Speed parameter (for move/rotate/head actions). Must be positive."
-                                },
-                                "distance": {
-                                    "type": "number",
-                                    "description": "Distance in meters (for move action). Positive = forward, negative = backward."
-                                },
-                                "angle": {
-                                    "type": "number",
-                                    "description": "Angle in degrees (for rotate/head actions). Positive = right/yes, negative = left/no."
-                                },
-                                "message": {
-                                    "type": "string",
-                                    "description": "Text to speak (for talk action)"
-                                },
-                                "volume": {
-                                    "type": "integer",
-                                    "description": "Volume level 100-500 (for talk action, default: 300)"
-                                },
-                                "axis": {
-                                    "type": "string",
-                                    "description": "Head movement type (for head action): 'yes' = nod, 'no' = shake",
-                                    "enum": ["yes", "no"]
-                                },
-                                "mood": {
-                                    "type": "string",
-                                    "description": "Facial expression (for mood action)",
-                                    "enum": ["happy", "sad", "angry", "surprised", "neutral", "afraid", "disgusted", "contempt"]
-                                }
-                            },
-                            "required": ["type"]
-                        },
-                        "minItems": 1
-                    }
-                },
-                "required": ["actions"]
-            }
-        )
-    ]
+    logger.debug("Listing available tools")
+    return list_tool_definitions()
 
 
-
-@app.call_tool()
+# Arguments are validated by the registry's precompiled parsers, so the SDK's
+# per-call jsonschema validation is turned off.
+@app.call_tool(validate_input=False)
 async def call_tool(name: str, arguments: dict) -> list[TextContent]:
     """
     Handle tool execution requests from Claude.
     
     This function routes tool calls to the appropriate handler in buddy_functions.py
     All operations are queued and will be executed by the Flask API.
+    Blocking handlers run on tool_executor so concurrent calls overlap and
+    never stall protocol I/O.
     """
-    log(f"Tool called: {name} with arguments: {arguments}")
+    logger.info("Tool called: %s", name, extra={"arguments": arguments})
     
     # Check if tool exists
-    if name not in TOOL_HANDLERS:
+    spec = TOOLS.get(name)
+    if spec is None:
         error_msg = f"Unknown tool: {name}"
-        log(f"ERROR: {error_msg}")
+        logger.error(error_msg)
         return [TextContent(type="text", text=f"Error: {error_msg}")]
     
+    started = time.perf_counter()
+    # Operations queued by this call are traced back to it (see tracing.py)
+    trace_token = tracing.begin_call(name)
     try:
-        # Call the appropriate handler from buddy_functions.py
-        handler = TOOL_HANDLERS[name]
-        result = handler(**arguments)
-        log(f"Tool '{name}' executed successfully")
+        if not state_ready.is_set():
+            await asyncio.to_thread(state_ready.wait, STATE_READY_TIMEOUT)
+        if shared_state_error() is not None:
+            raise RuntimeError(f"server failed to start: {shared_state_error()}")
+        if not state_ready.is_set():
+            raise RuntimeError(f"server not ready after {STATE_READY_TIMEOUT:g}s")
+        
+        # Validate arguments and call the appropriate handler from buddy_functions.py
+        arguments = spec.parse(arguments)
+        handler = spec.handler
+        if tool_executor is None or name in INLINE_TOOLS:
+            result = handler(**arguments)
+        else:
+            loop = asyncio.get_running_loop()
+            context = contextvars.copy_context()
+            result = await loop.run_in_executor(tool_executor, partial(context.run, handler, **arguments))
+        logger.debug("Tool '%s' executed successfully", name)
+        TOOL_CALL_SECONDS.observe(time.perf_counter() - started, name, "ok")
         return result
     except Exception as e:
         error_msg = f"Error executing {name}: {str(e)}"
-        log(f"ERROR: {error_msg}")
+        logger.error(error_msg)
+        TOOL_CALL_SECONDS.observe(time.perf_counter() - started, name, "error")
         return [TextContent(type="text", text=f"Error: {error_msg}")]
+    finally:
+        tracing.end_call(trace_token)
 
 
-async def run_server():
+async def run_server(on_listening=None, on_initialized=None):
     """
     Main server entry point.
     Runs the MCP server using stdio transport.
     
-    Note: Shared state (operation_queue, latest_image, queue_lock) must be
-    initialized by api.py BEFORE calling this function via init_shared_state().
+    Note: Shared state (the robot registry) is initialized by api.py via
+    init_shared_state(), possibly after this function started: tool calls
+    wait for it (see startup.py). on_listening, if given, is called once the
+    stdio transport is open and the handshake can be answered; on_initialized
+    once the client has confirmed the handshake (notifications/initialized).
     """
-    log("Starting Buddy MCP Server...")
-    log("Shared state should already be initialized by api.py")
+    logger.info("Starting Buddy MCP Server...")
+    logger.debug("Shared state is initialized by api.py, possibly after the handshake")
     
     # Run the server using stdio transport (standard for Claude Desktop)
-    log("Server ready - waiting for Claude Desktop connection...")
+    logger.info("Server ready - waiting for Claude Desktop connection...")
+    if on_initialized is not None:
+        async def initialized(notification):
+            on_initialized()
+        app.notification_handlers[InitializedNotification] = initialized
+    
     async with stdio_server() as (read_stream, write_stream):
+        if on_listening is not None:
+            on_listening()
         await app.run(read_stream, write_stream, app.create_initialization_options())
 
 
 def main():
     """Entry point when running the server directly"""
+    setup_logging()
     try:
         asyncio.run(run_server())
     except KeyboardInterrupt:
-        log("Server stopped by user")
-    except Exception as e:
-        log(f"Server error: {e}")
+        logger.info("Server stopped by user")
+    except Exception:
+        logger.exception("Server error")
         raise
 
 
@@ -0,0 +1,167 @@
+"""
+In-process metrics exposed in the Prometheus text format on /metrics.
+
+Counters and histograms are plain Python objects updated with one small lock
+each, so they stay on in production; nothing is computed until /metrics is
+scraped. Rates (enqueue / dequeue per second, ...) are left to the scraper:
+use rate() on the *_total counters.
+
+Instrumented code keeps references to the metric objects defined at the
+bottom of this module, e.g.
+
+    started = time.perf_counter()
+    ...
+    TOOL_CALL_SECONDS.observe(time.perf_counter() - started, name, "ok")
+"""
+import bisect
+import threading
+
+# Latency buckets (seconds) shared by the timing histograms
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Time an operation waits in the queue (seconds)
+QUEUE_TIME_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+# Lock waits are usually well below a millisecond
+LOCK_WAIT_BUCKETS = (0.000001, 0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0)
+# Payload sizes (bytes)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+_metrics = []  # in registration order
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *labelvalues, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labelvalues, value in values:
+            yield self.name, _format_labels(self.labelnames, labelvalues), value
+
+
+class Gauge:
+    """Value read when /metrics is scraped.
+
+    `collect` returns a list of (label values, value) pairs, so gauges such as
+    queue depth cost nothing between scrapes.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        _metrics.append(self)
+
+    def samples(self):
+        if self.collect is None:
+            return
+        for labelvalues, value in self.collect():
+            yield self.name, _format_labels(self.labelnames, labelvalues), value
+
+
+class Histogram:
+    """Distribution of observed values in fixed buckets, optionally split by labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [per-bucket counts (+Inf last), sum]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value: float, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def totals(self, *labelvalues):
+        """(count, sum) of the observations with these label values."""
+        with self._lock:
+            series = self._series.get(labelvalues)
+            return (sum(series[0]), series[1]) if series is not None else (0, 0.0)
+
+    def samples(self):
+        with self._lock:
+            series = [(labelvalues, list(counts), total) for labelvalues, (counts, total) in self._series.items()]
+        for labelvalues, counts, total in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, (("le", _format_value(bound)),))
+                yield f"{self.name}_bucket", labels, cumulative
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- Operation queue (operation_store.py) ---
+OPERATIONS_ENQUEUED = Counter("buddy_operations_enqueued_total", "Operations appended to a robot queue",
+                              ("robot", "type"))
+OPERATIONS_DELIVERED = Counter("buddy_operations_delivered_total", "Operations handed out to a robot (redeliveries included)",
+                               ("robot", "type"))
+OPERATION_QUEUE_SECONDS = Histogram("buddy_operation_queue_seconds", "Time between enqueue and first delivery",
+                                    ("type",), QUEUE_TIME_BUCKETS)
+QUEUE_LOCK_WAIT_SECONDS = Histogram("buddy_queue_lock_wait_seconds", "Time spent waiting for a robot queue lock",
+                                    ("operation",), LOCK_WAIT_BUCKETS)
+
+# --- Image pipeline (image_pipeline.py) ---
+IMAGE_STAGE_SECONDS = Histogram("buddy_image_stage_seconds", "Time spent in each stage of frame processing",
+                                ("stage",))
+FRAMES_PROCESSED = Counter("buddy_frames_processed_total", "Uploaded frames by outcome", ("result",))
+
+# --- MCP tools (mcp_server.py, buddy_functions.py) ---
+TOOL_CALL_SECONDS = Histogram("buddy_tool_call_seconds", "MCP call_tool latency", ("tool", "status"))
+TAKE_PICTURE_SECONDS = Histogram("buddy_take_picture_seconds", "take_picture latency")
+TAKE_PICTURE_BYTES = Histogram("buddy_take_picture_bytes", "Size of the base64 image returned by take_picture",
+                               buckets=SIZE_BUCKETS)
@@ -0,0 +1,644 @@
+"""
+Operation queue shared by the MCP tools, the CLI and the Flask endpoints.
+
+OperationQueue wraps the in-process priority heap together with its lock and
+the condition used by long-polling / streaming robots, and tracks leased
+(in-flight) operations until the robot acknowledges them. It can optionally
+be backed by a SqliteJournal so queued operations survive a restart.
+
+Set BUDDY_QUEUE_DB to a file path to enable the journal. Each robot other
+than the default one gets a sibling file (see journal_path()). Writes are
+group-committed behind the queue: a crash loses at most the changes of the
+last GROUP_COMMIT_WINDOW, while normal exits and SIGTERM (see startup.py)
+commit them first.
+
+Set BUDDY_QUEUE_COMPACT=1 to merge operations that are still waiting in the
+queue (see compact_operations()), so fewer round trips reach the robot.
+"""
+import asyncio
+import atexit
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from buddy_logging import get_logger
+from metrics import OPERATION_QUEUE_SECONDS, OPERATIONS_DELIVERED, OPERATIONS_ENQUEUED, QUEUE_LOCK_WAIT_SECONDS
+import tracing
+
+# Path of the SQLite journal (unset = in-memory queue only)
+QUEUE_DB_PATH = os.environ.get("BUDDY_QUEUE_DB")
+
+# Group commit window: writes arriving within this many seconds share one transaction.
+# It is also the write-behind window: changes not yet committed are lost if the process is killed.
+GROUP_COMMIT_WINDOW = float(os.environ.get("BUDDY_QUEUE_COMMIT_WINDOW", "0.005"))
+
+# Seconds before retrying a journal transaction that failed (disk full, locked database...)
+JOURNAL_RETRY_DELAY = 1.0
+
+# Max seconds close() waits for pending changes to be committed
+JOURNAL_CLOSE_TIMEOUT = 5.0
+
+# Priority lanes, most urgent first. Operations are delivered by lane, FIFO within a lane.
+PRIORITIES = {"urgent": 0, "high": 1, "normal": 2, "low": 3}
+DEFAULT_PRIORITY = "normal"
+
+# Operations flushed by a preempting operation (when in a lower-priority lane)
+MOTION_TYPES = {"MoveOperation", "RotateOperation", "HeadOperation"}
+
+# Merge newly queued operations into the pending one before them (opt-in)
+COMPACT_OPERATIONS = os.environ.get("BUDDY_QUEUE_COMPACT", "").lower() in ("1", "true", "yes", "on")
+
+# Actuator used by each operation type: operations on different actuators can run together
+ACTUATORS = {
+    "MoveOperation": "wheels",
+    "RotateOperation": "wheels",
+    "HeadOperation": "head",
+    "TalkOperation": "voice",
+    "MoodOperation": "face",
+}
+
+# Leased operations are dropped after this many unacknowledged deliveries
+MAX_DELIVERIES = int(os.environ.get("BUDDY_MAX_DELIVERIES", "5"))
+
+# How many acknowledged ids to remember so repeated acks are recognised
+ACKED_IDS_KEPT = 1024
+
+
+logger = get_logger("operation_store")
+
+
+def is_motion_operation(operation: dict) -> bool:
+    """True for a motion command, or a MultiOperation / ScriptOperation containing one."""
+    op_type = operation.get("type")
+    if op_type == "MultiOperation":
+        return any(is_motion_operation(op) for op in operation.get("operations", []))
+    if op_type == "ScriptOperation":
+        return any(is_motion_operation(op) for op in operation.get("steps", []))
+    return op_type in MOTION_TYPES
+
+
+def _actuators(operation: dict):
+    """Actuators used by an operation, or None if it cannot be folded into a MultiOperation."""
+    if operation.get("type") == "MultiOperation":
+        actuators = [ACTUATORS.get(op.get("type")) for op in operation.get("operations", [])]
+    else:
+        actuators = [ACTUATORS.get(operation.get("type"))]
+    if None in actuators or len(set(actuators)) != len(actuators):
+        return None
+    return set(actuators)
+
+
+def compact_operations(previous: dict, operation: dict):
+    """Merge `operation` into the `previous` one queued just before it.
+
+    - consecutive moves (or rotations) at the same speed become one, with
+      the distances (angles) summed; stops (0) are never merged, and
+      opposite moves that would sum to 0 are kept apart
+    - of consecutive mood changes only the last one is kept
+    - operations on different actuators are folded into one MultiOperation,
+      like multi_action() builds, and run at the same time
+
+    Returns the merged operation (keeping the id of `previous`), or None
+    when the two cannot be merged.
+    """
+    previous_type, op_type = previous.get("type"), operation.get("type")
+    if previous_type == op_type and op_type in ("MoveOperation", "RotateOperation"):
+        if previous.get("speed") != operation.get("speed"):
+            return None
+        field = "distance" if op_type == "MoveOperation" else "angle"
+        amounts = (previous.get(field, 0), operation.get(field, 0))
+        # 0 is the stop command: never absorb a stop, nor let opposite moves cancel out into one
+        if 0 in amounts or sum(amounts) == 0:
+            return None
+        return {**previous, field: sum(amounts)}
+    if previous_type == op_type == "MoodOperation":
+        return {**operation, "id": previous["id"]}
+
+    if op_type == "MultiOperation":
+        return None
+    if previous_type == "MultiOperation" and previous.get("operations"):
+        # Merge with the last operation folded in, e.g. two mood changes in a row
+        last = compact_operations({**previous["operations"][-1], "id": None}, operation)
+        if last is not None and last.get("type") != "MultiOperation":
+            last.pop("id")
+            return {**previous, "operations": previous["operations"][:-1] + [last]}
+    previous_actuators = _actuators(previous)
+    if previous_actuators is None or ACTUATORS.get(op_type) in previous_actuators | {None}:
+        return None
+    operation = {key: value for key, value in operation.items() if key != "id"}
+    if previous_type == "MultiOperation":
+        return {**previous, "operations": previous["operations"] + [operation]}
+    previous_op = {key: value for key, value in previous.items() if key != "id"}
+    return {"type": "MultiOperation", "operations": [previous_op, operation], "id": previous["id"]}
+
+
+class SqliteJournal:
+    """Append-only journal of pending operations in a SQLite database (WAL mode).
+
+    append()/remove() only record the change in memory and return at once; a
+    writer thread commits everything that accumulated during
+    GROUP_COMMIT_WINDOW in a single transaction. An operation that is queued
+    and handed out within the same window never touches the disk.
+
+    The journal is thus write-behind: until its transaction commits, a
+    change only exists in memory. A failed transaction is merged back into
+    the pending changes and retried after JOURNAL_RETRY_DELAY.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS operations (id INTEGER PRIMARY KEY, payload TEXT NOT NULL, "
+                           "priority INTEGER NOT NULL DEFAULT 2)")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(operations)")}
+        if "priority" not in columns:
+            self._conn.execute("ALTER TABLE operations ADD COLUMN priority INTEGER NOT NULL DEFAULT 2")
+        self._next_id = self._conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM operations").fetchone()[0]
+
+        self._cond = threading.Condition()
+        self._puts = {}  # id -> (payload, priority rank) waiting to be written
+        self._deletes = set()  # ids waiting to be deleted
+        self._writing = False
+        self._flush_requested = False
+        self._closed = False
+        self._writer = threading.Thread(target=self._writer_loop, name="queue-journal", daemon=True)
+        self._writer.start()
+        _journals.append(self)
+        atexit.register(self.close)
+
+    def load(self) -> list:
+        """Return the (id, operation, priority rank) still pending in the journal, oldest first."""
+        rows = self._conn.execute("SELECT id, payload, priority FROM operations ORDER BY id").fetchall()
+        return [(op_id, json.loads(payload), rank) for op_id, payload, rank in rows]
+
+    def append(self, operation: dict, rank: int = PRIORITIES[DEFAULT_PRIORITY]) -> int:
+        """Record a newly queued operation and return its journal id."""
+        payload = json.dumps(operation)
+        with self._cond:
+            op_id = self._next_id
+            self._next_id += 1
+            self._puts[op_id] = (payload, rank)
+            self._cond.notify()
+        return op_id
+
+    def remove(self, op_ids):
+        """Forget operations that were handed out to the robot."""
+        with self._cond:
+            for op_id in op_ids:
+                # Never written yet: just cancel the pending insert
+                if self._puts.pop(op_id, None) is None:
+                    self._deletes.add(op_id)
+            self._cond.notify()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Block until every recorded change is committed; False on timeout."""
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not (self._puts or self._deletes or self._writing), timeout)
+
+    def close(self):
+        """Flush pending changes and stop the writer thread."""
+        if self._closed:
+            return
+        if not self.flush(JOURNAL_CLOSE_TIMEOUT):
+            logger.error("Journal closed with uncommitted changes",
+                         extra={"path": self.path, "puts": len(self._puts), "deletes": len(self._deletes)})
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join()
+        self._conn.close()
+
+    def _writer_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._puts or self._deletes or self._closed)
+                if self._closed:
+                    return
+            with self._cond:
+                # Let concurrent writes pile up into the same transaction, unless flush() is waiting
+                self._cond.wait_for(lambda: self._flush_requested, GROUP_COMMIT_WINDOW)
+                self._flush_requested = False
+                puts, self._puts = self._puts, {}
+                deletes, self._deletes = self._deletes, set()
+                self._writing = True
+            try:
+                with self._conn:
+                    self._conn.execute("BEGIN")
+                    self._conn.executemany("INSERT OR REPLACE INTO operations (id, payload, priority) VALUES (?, ?, ?)",
+                                           ((op_id, payload, rank) for op_id, (payload, rank) in puts.items()))
+                    self._conn.executemany("DELETE FROM operations WHERE id = ?", ((op_id,) for op_id in deletes))
+            except Exception:
+                logger.exception("Error writing journal, retrying in %.1fs", JOURNAL_RETRY_DELAY,
+                                 extra={"path": self.path})
+                with self._cond:
+                    self._merge_back(puts, deletes)
+                    self._writing = False
+                    self._cond.notify_all()
+                    self._cond.wait_for(lambda: self._closed, JOURNAL_RETRY_DELAY)
+                continue
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+    def _merge_back(self, puts: dict, deletes: set):
+        """Put the changes of a failed transaction back with the ones recorded since."""
+        for op_id, put in puts.items():
+            if op_id in self._deletes:
+                # Removed since: it never reached the disk, nothing to write
+                self._deletes.discard(op_id)
+            else:
+                self._puts[op_id] = put
+        self._deletes |= deletes
+
+
+# Open journals, closed by close_journals()
+_journals = []
+
+
+def close_journals():
+    """Commit and close every journal (on SIGTERM, when atexit handlers don't run)."""
+    for journal in list(_journals):
+        journal.close()
+
+
+class QueuedOperation:
+    """An operation waiting in (or leased from) the queue."""
+
+    __slots__ = ("id", "rank", "seq", "journal_id", "operation", "deliveries", "lease_deadline", "enqueued_at")
+
+    def __init__(self, op_id, rank, seq, journal_id, operation):
+        self.id = op_id
+        self.rank = rank
+        self.seq = seq
+        self.journal_id = journal_id
+        self.operation = operation
+        self.deliveries = 0
+        self.lease_deadline = None
+        self.enqueued_at = time.monotonic()
+
+    def __lt__(self, other):
+        # Heap order: priority lane first, then arrival order
+        return (self.rank, self.seq) < (other.rank, other.seq)
+
+    def is_motion(self) -> bool:
+        """True for motion commands, including a MultiOperation or ScriptOperation that contains one."""
+        return is_motion_operation(self.operation)
+
+
+class OperationQueue:
+    """Priority queue of operations waiting to be delivered to Buddy.
+
+    `lock` is the shared lock also used by api.py/buddy_functions.py to guard
+    the latest image, and `not_empty` is notified on every append.
+
+    Operations are kept in a heap ordered by priority lane (see PRIORITIES)
+    and then arrival order, so each lane is FIFO and an urgent operation is
+    handed out on the very next poll. Queuing with preempt=True also drops
+    the pending motion commands of lower-priority lanes.
+
+    With compact=True, an operation is merged into the last one of its lane
+    when that one has not been delivered yet (see compact_operations()).
+
+    Every operation gets a unique "id" field. A robot that asks for a lease
+    when popping must acknowledge each operation with ack(id) before the
+    lease expires, otherwise the operation is put back at the head of its
+    lane and delivered again (at-least-once). The robot uses the id to skip
+    operations it has already executed.
+    """
+
+    def __init__(self, journal=None, compact: bool = False, name: str = None):
+        self.name = name  # robot id, used as metrics label
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.journal = journal
+        self.compact = compact
+        self._items = []  # heap of QueuedOperation
+        self._tails = {}  # priority rank -> last QueuedOperation appended to that lane
+        self._async_waiters = set()  # (event loop, asyncio.Event) of parked pop_async() calls
+        self._in_flight = {}  # id -> leased QueuedOperation
+        self._acked = OrderedDict()  # recently acknowledged ids, for idempotent acks
+        self._cancelled = OrderedDict()  # recently preempted leased ids, never redelivered
+        self._next_seq = 0
+
+        if journal is not None:
+            for journal_id, operation, rank in journal.load():
+                self._items.append(self._make_entry(operation, rank, journal_id))
+            heapq.heapify(self._items)
+            if self._items:
+                logger.info("Recovered %d pending operation(s) from %s", len(self._items), journal.path)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __bool__(self):
+        return bool(self._items)
+
+    def __iter__(self):
+        """Iterate over a snapshot of the pending operations, in delivery order."""
+        with self.lock:
+            return iter([entry.operation for entry in sorted(self._items)])
+
+    def in_flight_count(self) -> int:
+        """Number of leased operations waiting for an acknowledgement."""
+        return len(self._in_flight)
+
+    def _make_entry(self, operation: dict, rank: int, journal_id=None) -> QueuedOperation:
+        self._next_seq += 1
+        op_id = operation.get("id") or uuid.uuid4().hex[:16]
+        return QueuedOperation(op_id, rank, self._next_seq, journal_id, {**operation, "id": op_id})
+
+    def append(self, operation: dict, priority: str = DEFAULT_PRIORITY, preempt: bool = False) -> str:
+        """Queue an operation, wake up waiting robots and return its id.
+
+        The id is the one robots receive, ack and trace (/trace/<id>); when the
+        operation is compacted into a pending one, the id of that operation.
+        Raises ValueError for an unknown priority.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r} (expected one of {', '.join(PRIORITIES)})")
+        rank = PRIORITIES[priority]
+        OPERATIONS_ENQUEUED.inc(self.name, operation.get("type"))
+        started = time.perf_counter()
+        with self.lock:
+            QUEUE_LOCK_WAIT_SECONDS.observe(time.perf_counter() - started, "append")
+            if preempt:
+                self._preempt(rank)
+            elif self.compact:
+                merged_into = self._compact_into_tail(operation, rank)
+                if merged_into is not None:
+                    return merged_into
+            entry = self._make_entry(operation, rank)
+            if self.journal is not None:
+                entry.journal_id = self.journal.append(entry.operation, rank)
+            heapq.heappush(self._items, entry)
+            self._tails[rank] = entry
+            tracing.record_enqueue(entry.id, entry.operation, self.name)
+            self.not_empty.notify_all()
+            self._wake_async_waiters()
+            return entry.id
+
+    def _compact_into_tail(self, operation: dict, rank: int):
+        """Try to merge an operation into the last pending one of its lane.
+
+        Returns the id of the operation merged into, or None. Must be called
+        with the lock held.
+        """
+        tail = self._tails.get(rank)
+        # Already handed out (or leased) at least once: too late to change it
+        if tail is None or tail.deliveries:
+            return None
+        merged = compact_operations(tail.operation, operation)
+        if merged is None:
+            return None
+        tail.operation = merged
+        if self.journal is not None:
+            self.journal.remove([tail.journal_id])
+            tail.journal_id = self.journal.append(merged, rank)
+        logger.debug("Compacted %s into pending operation %s", operation.get("type"), tail.id)
+        return tail.id
+
+    def _preempt(self, rank: int):
+        """Drop the motion commands of lanes below `rank`: pending ones, and
+        leased ones, which are cancelled so an expired lease never sends them
+        again after the preempting operation.
+
+        Must be called with the lock held.
+        """
+        flushed = [entry for entry in self._items if entry.rank > rank and entry.is_motion()]
+        if flushed:
+            kept = [entry for entry in self._items if entry.rank <= rank or not entry.is_motion()]
+            heapq.heapify(kept)
+            self._items = kept
+            self._tails.clear()
+            logger.info("Preempted %d pending motion operation(s)", len(flushed))
+
+        cancelled = [entry for entry in self._in_flight.values() if entry.rank > rank and entry.is_motion()]
+        for entry in cancelled:
+            del self._in_flight[entry.id]
+            _remember(self._cancelled, entry.id)
+        if cancelled:
+            logger.info("Cancelled %d leased motion operation(s)", len(cancelled))
+
+        if self.journal is not None and (flushed or cancelled):
+            self.journal.remove([entry.journal_id for entry in flushed + cancelled])
+
+    def pop(self, max_count=1, wait: float = 0.0, lease: float = None) -> list:
+        """Remove and return up to max_count operations (None = all), in delivery order.
+
+        If the queue is empty, wait up to `wait` seconds for an operation.
+        With a lease (seconds), operations stay in flight until ack() and are
+        redelivered if the lease expires; without one they are handed out
+        fire-and-forget and removed from the journal right away.
+        """
+        deadline = time.monotonic() + wait
+        started = time.perf_counter()
+        with self.not_empty:
+            QUEUE_LOCK_WAIT_SECONDS.observe(time.perf_counter() - started, "pop")
+            while True:
+                self._requeue_expired()
+                remaining = deadline - time.monotonic()
+                if self._items or remaining <= 0:
+                    break
+                # Also wake up when a lease expires so its operation is redelivered promptly
+                next_expiry = self._next_lease_expiry()
+                if next_expiry is not None:
+                    remaining = min(remaining, max(next_expiry - time.monotonic(), 0.001))
+                self.not_empty.wait(remaining)
+
+            count = len(self._items) if max_count is None else min(max_count, len(self._items))
+            popped = [heapq.heappop(self._items) for _ in range(count)]
+            for entry in popped:
+                # Handed out: no longer a compaction target, and not kept alive by _tails
+                if self._tails.get(entry.rank) is entry:
+                    del self._tails[entry.rank]
+            now = time.monotonic()
+            wall_now = time.time()
+            for entry in popped:
+                op_type = entry.operation.get("type")
+                if not entry.deliveries:
+                    OPERATION_QUEUE_SECONDS.observe(now - entry.enqueued_at, op_type)
+                    tracing.record(entry.id, "dequeued", wall_now)
+                OPERATIONS_DELIVERED.inc(self.name, op_type)
+                entry.deliveries += 1
+                if lease:
+                    entry.lease_deadline = now + lease
+                    self._in_flight[entry.id] = entry
+            if self.journal is not None and popped and not lease:
+                self.journal.remove(entry.journal_id for entry in popped)
+        return [entry.operation for entry in popped]
+
+    async def pop_async(self, max_count=1, wait: float = 0.0, lease: float = None) -> list:
+        """Coroutine version of pop() for the ASGI server (see asgi_server.py).
+
+        A parked poll waits on an asyncio.Event set by append(), so it holds
+        no thread; the lock is only taken for the non-blocking pops.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        while True:
+            waiter = (loop, asyncio.Event())
+            # Register before popping so an append in between is not missed
+            with self.lock:
+                self._async_waiters.add(waiter)
+            try:
+                ops = self.pop(max_count, 0.0, lease)
+                remaining = deadline - loop.time()
+                if ops or remaining <= 0:
+                    return ops
+                with self.lock:
+                    next_expiry = self._next_lease_expiry()
+                if next_expiry is not None:
+                    remaining = min(remaining, max(next_expiry - time.monotonic(), 0.001))
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            finally:
+                with self.lock:
+                    self._async_waiters.discard(waiter)
+
+    def _wake_async_waiters(self):
+        """Wake up parked pop_async() calls. Must be called with the lock held."""
+        if not self._async_waiters:
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        for loop, event in self._async_waiters:
+            if loop is running_loop:
+                event.set()
+            else:
+                loop.call_soon_threadsafe(event.set)
+
+    def _next_lease_expiry(self):
+        """Monotonic deadline of the first lease to expire, or None. Must be called with the lock held."""
+        return min((entry.lease_deadline for entry in self._in_flight.values()), default=None)
+
+    def ack(self, op_id: str, duration: float = None) -> str:
+        """Acknowledge a leased operation.
+
+        Also completes the operation's trace (see tracing.py), which is how
+        robots polling without a lease report completion.
+
+        Returns "acked", "duplicate" (already acknowledged), "cancelled"
+        (preempted while leased), "traced" (not leased, but its trace was
+        completed) or "unknown".
+        """
+        traced = tracing.record_completion(op_id, duration)
+        with self.lock:
+            entry = self._in_flight.pop(op_id, None)
+            if entry is None:
+                if op_id in self._acked:
+                    return "duplicate"
+                if op_id in self._cancelled:
+                    return "cancelled"
+                return "traced" if traced else "unknown"
+            _remember(self._acked, op_id, duration)
+            if self.journal is not None:
+                self.journal.remove([entry.journal_id])
+        logger.debug("Operation %s acknowledged", op_id, extra={"deliveries": entry.deliveries, "duration": duration})
+        return "acked"
+
+    def release(self, op_ids) -> int:
+        """Put leased operations back in the queue now, without waiting for their lease to expire.
+
+        Used when the connection they were pushed on closes. Ids that are no
+        longer in flight (acknowledged, cancelled, expired) are ignored.
+        Returns the number of operations put back.
+        """
+        with self.lock:
+            released = [self._in_flight.pop(op_id) for op_id in op_ids if op_id in self._in_flight]
+            for entry in released:
+                entry.lease_deadline = None
+                heapq.heappush(self._items, entry)
+            if released:
+                self.not_empty.notify_all()
+                self._wake_async_waiters()
+        if released:
+            logger.info("Released %d unacknowledged operation(s) back to the queue", len(released))
+        return len(released)
+
+    def _requeue_expired(self):
+        """Put operations whose lease expired back in the queue at their original place.
+
+        Must be called with the lock held.
+        """
+        if not self._in_flight:
+            return
+        now = time.monotonic()
+        expired = [entry for entry in self._in_flight.values() if entry.lease_deadline <= now]
+        for entry in expired:
+            del self._in_flight[entry.id]
+            if entry.deliveries >= MAX_DELIVERIES:
+                logger.warning("Dropping operation %s after %d unacknowledged deliveries", entry.id, entry.deliveries)
+                if self.journal is not None:
+                    self.journal.remove([entry.journal_id])
+                continue
+            logger.info("Lease expired for operation %s, redelivering", entry.id)
+            entry.lease_deadline = None
+            heapq.heappush(self._items, entry)
+
+
+def _remember(recent: OrderedDict, op_id: str, value=None):
+    """Record an id in a bounded dict of recent ids (ACKED_IDS_KEPT)."""
+    recent[op_id] = value
+    while len(recent) > ACKED_IDS_KEPT:
+        recent.popitem(last=False)
+
+
+def journal_path(robot_id: str = None):
+    """Journal file of a robot: BUDDY_QUEUE_DB for the default robot, a sibling file otherwise.
+
+    Returns None when journaling is disabled.
+    """
+    if not QUEUE_DB_PATH or robot_id is None:
+        return QUEUE_DB_PATH
+    root, extension = os.path.splitext(QUEUE_DB_PATH)
+    return f"{root}-{robot_id}{extension}"
+
+
+def _has_pending_operations(path: str) -> bool:
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            return conn.execute("SELECT 1 FROM operations LIMIT 1").fetchone() is not None
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+
+
+def journaled_robot_ids() -> list:
+    """Ids of the non-default robots whose journal file still holds operations."""
+    if not QUEUE_DB_PATH:
+        return []
+    root, extension = os.path.splitext(QUEUE_DB_PATH)
+    directory, prefix = os.path.split(root + "-")
+    directory = directory or "."
+    return [
+        name[len(prefix):len(name) - len(extension)]
+        for name in sorted(os.listdir(directory))
+        if name.startswith(prefix) and name.endswith(extension) and len(name) > len(prefix) + len(extension)
+        and _has_pending_operations(os.path.join(directory, name))
+    ]
+
+
+def create_operation_queue(robot_id: str = None, name: str = None) -> OperationQueue:
+    """Build a robot's queue, journaled if BUDDY_QUEUE_DB is set and
+    compacting if BUDDY_QUEUE_COMPACT is set.
+
+    robot_id None means the default robot (journal file name); name is the
+    robot id used in metrics.
+    """
+    path = journal_path(robot_id)
+    journal = SqliteJournal(path) if path else None
+    return OperationQueue(journal, compact=COMPACT_OPERATIONS, name=name or robot_id)
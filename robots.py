@@ -0,0 +1,121 @@
+"""
+Per-robot state for serving several Buddy units from one process.
+
+Each robot has its own operation queue (with its own lock), frame cache,
+frame history and image pipeline, so units never contend with each other.
+Robots are identified by a short id: ?robot=<id> on the HTTP endpoints and
+the robot_id argument of the MCP tools. Requests without an id go to the
+default robot (BUDDY_DEFAULT_ROBOT, "buddy" by default), which keeps the
+original single-robot file names.
+
+Robots exist from the start when listed in BUDDY_ROBOTS (comma-separated
+ids). Other robots are only created by the robot itself, on its first poll
+or upload, and at most BUDDY_MAX_ROBOTS of them: a robot costs a queue,
+a journal file and a writer thread, so reading /frames or queuing a tool
+call for a mistyped id must not create one.
+"""
+import os
+import re
+import threading
+from collections import deque
+
+from buddy_logging import get_logger
+from image_pipeline import FRAME_HISTORY_SIZE, ImagePipeline, latest_image_path
+from operation_store import create_operation_queue, journaled_robot_ids
+
+DEFAULT_ROBOT_ID = os.environ.get("BUDDY_DEFAULT_ROBOT", "buddy")
+
+# Robots created at startup, in addition to the default one
+CONFIGURED_ROBOT_IDS = [robot_id.strip() for robot_id in os.environ.get("BUDDY_ROBOTS", "").split(",")
+                        if robot_id.strip()]
+
+# Upper bound on the number of robots created on demand (default and configured robots excepted)
+MAX_ROBOTS = int(os.environ.get("BUDDY_MAX_ROBOTS", "16"))
+
+logger = get_logger("robots")
+
+# Robot ids end up in file names, so keep them simple
+ROBOT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+
+class UnknownRobotError(LookupError):
+    """The robot doesn't exist and can't be created here (or the robot limit is reached)."""
+
+
+class RobotState:
+    """Everything the server keeps for one robot."""
+
+    def __init__(self, robot_id: str):
+        self.id = robot_id
+        # The default robot keeps the single-robot journal and image file names
+        suffix = None if robot_id == DEFAULT_ROBOT_ID else robot_id
+
+        self.operation_queue = create_operation_queue(suffix, robot_id)
+        self.lock = self.operation_queue.lock  # Guards the queue and the frame cache of this robot only
+        self.latest_image = {"bytes": None, "base64": None, "mime_type": None, "version": 0, "timestamp": None}
+        self.frame_history = deque(maxlen=FRAME_HISTORY_SIZE)  # Last processed frames, oldest first
+        self.image_pipeline = ImagePipeline(robot_id, self.latest_image, self.frame_history, self.lock,
+                                            latest_image_path(suffix))
+        # (version, ImageContent) of the last frame returned by take_picture
+        self.picture_cache = (None, None)
+
+
+class RobotRegistry:
+    """Robots known to the server."""
+
+    def __init__(self):
+        self._robots = {}
+        self._lock = threading.Lock()
+        # Always have the default and configured robots
+        for robot_id in [DEFAULT_ROBOT_ID] + CONFIGURED_ROBOT_IDS:
+            if not ROBOT_ID_PATTERN.match(robot_id):
+                raise ValueError(f"Invalid robot id in BUDDY_DEFAULT_ROBOT or BUDDY_ROBOTS: {robot_id!r}")
+            if robot_id not in self._robots:
+                self._robots[robot_id] = RobotState(robot_id)
+        self._capacity = len(self._robots) + MAX_ROBOTS
+        # Bring back robots that still have journaled operations
+        for robot_id in journaled_robot_ids():
+            try:
+                self.get(robot_id, create=True)
+            except (ValueError, UnknownRobotError) as e:
+                logger.warning("Not restoring journaled robot %r: %s", robot_id, e)
+
+    def get(self, robot_id: str = None, create: bool = False) -> RobotState:
+        """Return the state of a robot (the default one if robot_id is empty).
+
+        Unknown robots are only created with create=True (the robot's own
+        polls and uploads), up to MAX_ROBOTS. Raises ValueError for malformed
+        ids and UnknownRobotError otherwise.
+        """
+        robot_id = robot_id or DEFAULT_ROBOT_ID
+        robot = self._robots.get(robot_id)
+        if robot is not None:
+            return robot
+
+        if not ROBOT_ID_PATTERN.match(robot_id):
+            raise ValueError(f"Invalid robot id: {robot_id!r}")
+        if not create:
+            raise UnknownRobotError(f"Unknown robot: {robot_id!r}")
+        with self._lock:
+            robot = self._robots.get(robot_id)
+            if robot is None:
+                if len(self._robots) >= self._capacity:
+                    raise UnknownRobotError(f"Robot limit reached (BUDDY_MAX_ROBOTS={MAX_ROBOTS}): {robot_id!r}")
+                robot = self._robots[robot_id] = RobotState(robot_id)
+                logger.info("New robot %s", robot_id)
+        return robot
+
+    def __iter__(self):
+        return iter(list(self._robots.values()))
+
+    def summaries(self) -> list:
+        """Id, queue depth, leases and latest frame version of every robot (GET /robots)."""
+        return [
+            {"id": robot.id, "queue_size": len(robot.operation_queue),
+             "in_flight": robot.operation_queue.in_flight_count(),
+             "image_version": robot.latest_image["version"]}
+            for robot in self
+        ]
+
+    def __len__(self):
+        return len(self._robots)
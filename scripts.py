@@ -0,0 +1,90 @@
+"""
+Named action scripts for run_script (see buddy_functions.py).
+
+A script is the list of steps given to run_script: actions (like those of
+multi_action), parallel blocks, nested sequences, waits and repeats. The
+ScriptStore keeps each script by name, as written (the source) and compiled
+into the flat plan of a ScriptOperation, so running a stored behaviour again
+costs neither validation nor compilation.
+
+Set BUDDY_SCRIPTS_FILE to a JSON file path to keep stored scripts across
+restarts. Only the sources are saved; they are compiled again on first use
+after a restart.
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+from buddy_logging import get_logger
+
+# JSON file of stored scripts (unset = kept in memory only)
+SCRIPTS_PATH = os.environ.get("BUDDY_SCRIPTS_FILE")
+
+SCRIPT_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+logger = get_logger("scripts")
+
+
+class ScriptStore:
+    """Scripts stored by name: source steps, and their compiled plan once built."""
+
+    def __init__(self, path: str = SCRIPTS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # name -> {"steps": source, "plan": compiled operations or None, "descriptions": [...]}
+        self._scripts = {}
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                sources = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error("Could not read stored scripts from %s: %s", self.path, e)
+            return
+        for name, steps in sources.items():
+            self._scripts[name] = {"steps": steps, "plan": None, "descriptions": None}
+        logger.info("Loaded %d stored script(s) from %s", len(sources), self.path)
+
+    def _save(self):
+        """Write the sources to the scripts file (atomic replace). Must be called with the lock held."""
+        if not self.path:
+            return
+        sources = {name: script["steps"] for name, script in self._scripts.items()}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(sources, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error("Could not save stored scripts to %s: %s", self.path, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def put(self, name: str, steps: list, plan: list, descriptions: list):
+        """Store (or replace) a compiled script. Raises ValueError for malformed names."""
+        if not SCRIPT_NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid script name: {name!r}")
+        with self._lock:
+            self._scripts[name] = {"steps": steps, "plan": plan, "descriptions": descriptions}
+            self._save()
+
+    def get(self, name: str):
+        """The stored script (dict with steps, plan, descriptions), or None."""
+        return self._scripts.get(name)
+
+    def set_plan(self, name: str, plan: list, descriptions: list):
+        """Cache the compiled plan of a script loaded from the scripts file."""
+        with self._lock:
+            script = self._scripts.get(name)
+            if script is not None:
+                script["plan"], script["descriptions"] = plan, descriptions
+
+    def names(self) -> list:
+        return sorted(self._scripts)
+
+    def __len__(self):
+        return len(self._scripts)
@@ -0,0 +1,191 @@
+"""
+Simulated Buddy robots, to exercise the server without the physical robot.
+
+Each VirtualRobot runs in its own thread and behaves like the Android app:
+it polls /operation (optionally long-polling and leasing), "executes" each
+operation by sleeping for a realistic duration, acknowledges it and uploads
+synthetic camera frames to /upload_image.
+
+Usage:
+    python simulator.py --robots 3 --url http://127.0.0.1:5000
+
+Only the standard library and Pillow are needed. benchmark.py drives the
+same robots against an in-process server.
+"""
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from io import BytesIO
+from PIL import Image, ImageDraw
+
+
+def operation_duration(operation: dict) -> float:
+    """Rough time (seconds) the real robot takes to run an operation."""
+    op_type = operation.get("type")
+    if op_type == "MoveOperation":
+        speed = max(abs(operation.get("speed", 100)), 1)
+        return 0.5 + abs(operation.get("distance", 0)) * 100 / speed
+    if op_type == "RotateOperation":
+        speed = max(abs(operation.get("speed", 50)), 1)
+        return 0.3 + abs(operation.get("angle", 0)) / speed
+    if op_type == "TalkOperation":
+        # Roughly 15 characters per second of speech
+        return 0.3 + len(operation.get("message", "")) / 15
+    if op_type == "HeadOperation":
+        return 1.0
+    if op_type == "MoodOperation":
+        return 0.2
+    if op_type == "MultiOperation":
+        # Sub-operations run at the same time
+        return max((operation_duration(op) for op in operation.get("operations", [])), default=0.0)
+    if op_type == "ScriptOperation":
+        # Steps run one after another
+        return sum(operation_duration(op) for op in operation.get("steps", []))
+    if op_type == "WaitOperation":
+        return operation.get("seconds", 0.0)
+    return 0.1
+
+
+def synthetic_frames(count: int = 8, size=(640, 480), quality: int = 80) -> list:
+    """Pre-encoded JPEG frames of a moving shape, so consecutive uploads differ."""
+    frames = []
+    for i in range(count):
+        img = Image.new("RGB", size, (40, 60, 90))
+        draw = ImageDraw.Draw(img)
+        x = int((size[0] - 120) * i / max(count - 1, 1))
+        draw.rectangle([x, size[1] // 3, x + 120, size[1] // 3 + 120], fill=(220, 180, 40))
+        draw.text((10, 10), f"frame {i}", fill=(255, 255, 255))
+        buffer = BytesIO()
+        img.save(buffer, "JPEG", quality=quality)
+        frames.append(buffer.getvalue())
+    return frames
+
+
+class VirtualRobot:
+    """One simulated robot polling the server from a background thread."""
+
+    def __init__(self, base_url: str, robot_id: str = None, poll_interval: float = 0.1, wait: float = 0.0,
+                 lease: float = None, fps: float = 0.0, time_scale: float = 1.0, frames=None):
+        self.base_url = base_url.rstrip("/")
+        self.robot_id = robot_id
+        self.poll_interval = poll_interval
+        self.wait = wait
+        self.lease = lease
+        self.fps = fps
+        self.time_scale = time_scale
+        self.frames = frames or []
+        self.stats = {"polls": 0, "operations": 0, "uploads": 0, "errors": 0}
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _url(self, path: str, **params) -> str:
+        if self.robot_id:
+            params["robot"] = self.robot_id
+        query = "&".join(f"{key}={value}" for key, value in params.items() if value is not None)
+        return f"{self.base_url}{path}?{query}" if query else f"{self.base_url}{path}"
+
+    def _request(self, url: str, data: bytes = None, content_type: str = "application/json"):
+        request = urllib.request.Request(url, data=data, headers={"Content-Type": content_type} if data else {})
+        with urllib.request.urlopen(request, timeout=self.wait + 10) as response:
+            return json.loads(response.read())
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._poll_loop, name=f"sim-poll-{self.robot_id}", daemon=True)]
+        if self.fps > 0 and self.frames:
+            self._threads.append(threading.Thread(target=self._upload_loop, name=f"sim-upload-{self.robot_id}", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=self.wait + 10)
+
+    def _poll_loop(self):
+        while not self._stop.is_set():
+            try:
+                reply = self._request(self._url("/operation", wait=self.wait or None, lease=self.lease))
+                self.stats["polls"] += 1
+            except (urllib.error.URLError, OSError, ValueError):
+                self.stats["errors"] += 1
+                self._stop.wait(self.poll_interval)
+                continue
+
+            operation = reply.get("operation")
+            if operation is None:
+                if not self.wait:
+                    self._stop.wait(self.poll_interval)
+                continue
+            self.execute(operation)
+
+    def execute(self, operation: dict):
+        """Pretend to run an operation, then report its completion."""
+        duration = operation_duration(operation) * self.time_scale
+        self._stop.wait(duration)
+        self.stats["operations"] += 1
+        try:
+            self._request(self._url(f"/operation/{operation['id']}/ack"), json.dumps({"duration": duration}).encode())
+        except (urllib.error.URLError, OSError, ValueError):
+            # 404 for untraced fire-and-forget operations is expected
+            pass
+
+    def _upload_loop(self):
+        period = 1.0 / self.fps
+        index = random.randrange(len(self.frames))
+        next_upload = time.monotonic()
+        while not self._stop.is_set():
+            frame = self.frames[index % len(self.frames)]
+            index += 1
+            payload = json.dumps({"image_base64": base64.b64encode(frame).decode("ascii")}).encode()
+            try:
+                self._request(self._url("/upload_image"), payload)
+                self.stats["uploads"] += 1
+            except (urllib.error.URLError, OSError, ValueError):
+                self.stats["errors"] += 1
+            next_upload += period
+            self._stop.wait(max(next_upload - time.monotonic(), 0))
+
+
+def start_robots(base_url: str, count: int, **options) -> list:
+    """Start `count` virtual robots. The first one is the default robot, the others sim-1, sim-2..."""
+    frames = synthetic_frames() if options.get("fps") else None
+    return [
+        VirtualRobot(base_url, None if i == 0 else f"sim-{i}", frames=frames, **options).start()
+        for i in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate Buddy robots against a running server")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="Server base URL")
+    parser.add_argument("--robots", type=int, default=1, help="Number of virtual robots")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="Seconds between polls when idle")
+    parser.add_argument("--wait", type=float, default=0.0, help="Long-poll wait (seconds, 0 = short polling)")
+    parser.add_argument("--lease", type=float, default=None, help="Lease operations for this many seconds and ack them")
+    parser.add_argument("--fps", type=float, default=1.0, help="Camera frames uploaded per second and per robot")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Multiply operation durations (0.1 = 10x faster)")
+    args = parser.parse_args()
+
+    robots = start_robots(args.url, args.robots, poll_interval=args.poll_interval, wait=args.wait,
+                          lease=args.lease, fps=args.fps, time_scale=args.time_scale)
+    print(f"Simulating {len(robots)} robot(s) against {args.url}, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(5)
+            for robot in robots:
+                print(f"  {robot.robot_id or 'default'}: {robot.stats}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for robot in robots:
+            robot.stop()
+
+
+if __name__ == '__main__':
+    main()
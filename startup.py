@@ -0,0 +1,346 @@
+"""
+Startup of the Buddy server: `python api.py [--cli] [--asgi] [--import-profile]`.
+
+Claude Desktop starts api.py for every session and waits for the answer to
+MCP `initialize`, which only needs the mcp package. So in MCP mode the main
+thread imports mcp_server and opens the stdio transport first; the HTTP side
+(Flask, Werkzeug, PIL, the state broker, the robot registry) is imported by a
+background thread once the handshake is done (notifications/initialized, or
+HANDSHAKE_GRACE seconds after MCP listens), so its imports don't compete with
+the handshake for the GIL, followed by a warm-up of the tool schemas. Tool
+calls arriving before the registry exists wait for it
+(buddy_functions.state_ready). The CLI never imports mcp.
+
+Startup milestones are recorded on every run. The time until MCP listens is
+checked against COLD_START_BUDGET and a warning is logged when it is over.
+--import-profile also times every module import (self time, grouped by
+top-level package) and prints a report on stderr once startup is complete.
+Times are measured from the start of api.py, interpreter startup excluded:
+`python benchmark.py --cold-start 5` measures the whole process from outside.
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+
+# Max milliseconds from the start of api.py until the MCP server listens. Importing
+# the mcp package alone takes 450-600 ms depending on the machine, so this leaves
+# room for slow starts while still catching imports added to the handshake path.
+COLD_START_BUDGET = float(os.environ.get("BUDDY_COLD_START_BUDGET", "1000"))
+
+# Max seconds the HTTP side waits for notifications/initialized before loading anyway
+HANDSHAKE_GRACE = 1.0
+
+_started = time.perf_counter()
+_milestones = []
+_pending = set()
+_lock = threading.Lock()
+_profiler = None
+
+
+def mark(name: str):
+    """Record a startup milestone (milliseconds since the start of api.py)."""
+    with _lock:
+        _milestones.append((name, (time.perf_counter() - _started) * 1000))
+
+
+def milestone(name: str):
+    """Milliseconds at which a milestone was reached, or None."""
+    return next((ms for recorded, ms in _milestones if recorded == name), None)
+
+
+class ImportProfiler:
+    """Meta path finder timing every module import (--import-profile).
+
+    It lets the other finders locate the module and wraps the loader's
+    exec_module(); the self time of nested imports is subtracted from their
+    parent, per thread, so the background imports are accounted correctly.
+    """
+
+    def __init__(self):
+        self.self_times = {}
+        self.modules = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+        return self
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _add(self, name: str, seconds: float):
+        package = name.partition(".")[0]
+        with self._lock:
+            self.self_times[package] = self.self_times.get(package, 0.0) + seconds
+            self.modules[package] = self.modules.get(package, 0) + 1
+
+    def find_spec(self, name, path=None, target=None):
+        started = time.perf_counter()
+        spec = None
+        for finder in sys.meta_path:
+            find_spec = getattr(finder, "find_spec", None)
+            if finder is self or find_spec is None:
+                continue
+            spec = find_spec(name, path, target)
+            if spec is not None:
+                break
+        found = time.perf_counter() - started
+        stack = self._stack()
+        if stack:
+            stack[-1] += found
+        if spec is None:
+            return None
+
+        self._add(name, found)
+        loader = spec.loader
+        # Built-in and frozen modules are loaded by classes: not worth timing
+        if loader is not None and not isinstance(loader, type) and hasattr(loader, "exec_module"):
+            try:
+                loader.exec_module = self._timed(name, loader.exec_module)
+            except AttributeError:
+                pass
+        return spec
+
+    def _timed(self, name: str, exec_module):
+        def timed_exec_module(module):
+            stack = self._stack()
+            stack.append(0.0)
+            started = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                elapsed = time.perf_counter() - started
+                children = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                self._add(name, elapsed - children)
+        return timed_exec_module
+
+    def report(self, limit: int = 15) -> str:
+        with self._lock:
+            ranked = sorted(self.self_times.items(), key=lambda item: item[1], reverse=True)
+            total = sum(self.self_times.values())
+            modules = dict(self.modules)
+        lines = [f"Imports: {sum(modules.values())} modules, {total * 1000:.0f} ms (self time per top-level package):"]
+        lines += [f"  {name:<24} {seconds * 1000:8.1f} ms  {modules[name]:4d} module(s)"
+                  for name, seconds in ranked[:limit]]
+        return "\n".join(lines)
+
+
+def _report() -> str:
+    lines = ["Buddy startup (ms since the start of api.py):"]
+    lines += [f"  {ms:8.1f}  {name}" for name, ms in _milestones]
+    if _profiler is not None:
+        lines.append(_profiler.report())
+    return "\n".join(lines)
+
+
+def _done(part: str):
+    """Called when the MCP or HTTP side is up; reports once both are."""
+    from buddy_logging import get_logger
+    logger = get_logger("startup")
+
+    with _lock:
+        _pending.discard(part)
+        if _pending:
+            return
+    mark("startup complete")
+
+    listening = milestone("mcp listening")
+    if listening is not None:
+        logger.info("Startup complete: MCP listening after %.0f ms, HTTP after %.0f ms",
+                    listening, milestone("http started"))
+        if listening > COLD_START_BUDGET:
+            logger.warning("Cold start over budget: MCP listening after %.0f ms (budget %.0f ms)",
+                           listening, COLD_START_BUDGET)
+    else:
+        logger.info("Startup complete: HTTP after %.0f ms", milestone("http started"))
+
+    if _profiler is not None:
+        _profiler.uninstall()
+        # One write on stderr (stdout is the MCP stream), so log lines don't interleave
+        sys.stderr.write(_report() + "\n")
+        sys.stderr.flush()
+
+
+def load_http_side(asgi: bool = False):
+    """Import the HTTP side and share its robot registry with the tools; returns the api module."""
+    import api
+    if asgi:
+        import asgi_server  # noqa: F401 (uvicorn and starlette, off the event loop)
+    mark("http imported")
+
+    from buddy_functions import init_shared_state
+    from state_broker import BROKER_ADDRESS, serve_broker
+    # Initialize shared state for buddy functions (used by MCP tools and the CLI)
+    init_shared_state(api.robots)
+    # Let HTTP worker processes attach to this process's state
+    if BROKER_ADDRESS:
+        serve_broker(api.robots)
+    mark("shared state ready")
+    return api
+
+
+def warm_up():
+    """Build the tool definitions and validators before the first tools/list and call."""
+    from tool_registry import compile_tools
+    compile_tools()
+    mark("warm-up done")
+
+
+def _start_http_background():
+    """Background thread of MCP mode: HTTP side, Flask server, warm-up."""
+    from buddy_logging import get_logger
+    try:
+        api = load_http_side()
+        api.start_flask_thread()
+        mark("http started")
+        warm_up()
+    except Exception as e:
+        get_logger("startup").exception("HTTP side failed to start")
+        # Tool calls waiting for the registry get this error instead of a timeout
+        from buddy_functions import fail_shared_state
+        fail_shared_state(e)
+        return
+    _done("http")
+
+
+def _on_mcp_listening():
+    mark("mcp listening")
+    _done("mcp")
+
+
+def _once(func):
+    """Wrap func so that only its first call runs (from any thread)."""
+    called = threading.Event()
+    lock = threading.Lock()
+
+    def wrapper():
+        with lock:
+            if called.is_set():
+                return
+            called.set()
+        func()
+    return wrapper
+
+
+async def _serve_mcp_asgi(run_server):
+    """--asgi MCP mode: answer MCP first, then load the HTTP side off the loop and serve it on the loop."""
+    import asyncio
+
+    listening = asyncio.Event()
+    initialized = asyncio.Event()
+
+    def on_listening():
+        _on_mcp_listening()
+        listening.set()
+
+    def on_initialized():
+        mark("mcp initialized")
+        initialized.set()
+
+    mcp_task = asyncio.create_task(run_server(on_listening, on_initialized))
+    listening_task = asyncio.create_task(listening.wait())
+    await asyncio.wait({mcp_task, listening_task}, return_when=asyncio.FIRST_COMPLETED)
+    if mcp_task.done():
+        listening_task.cancel()
+        return await mcp_task
+
+    try:
+        await asyncio.wait_for(initialized.wait(), HANDSHAKE_GRACE)
+    except asyncio.TimeoutError:
+        pass
+    try:
+        api = await asyncio.to_thread(load_http_side, True)
+    except Exception as e:
+        from buddy_functions import fail_shared_state
+        from buddy_logging import get_logger
+        get_logger("startup").exception("HTTP side failed to start")
+        # Keep answering MCP: tool calls report the error instead of waiting for the registry
+        fail_shared_state(e)
+        return await mcp_task
+    from asgi_server import serve_with_mcp
+    mark("http started")
+    asyncio.get_running_loop().run_in_executor(None, lambda: (warm_up(), _done("http")))
+    # HTTP and MCP (stdio mode) share one event loop in the main thread
+    await serve_with_mcp(lambda: mcp_task, api.app, api.robots)
+
+
+def _on_sigterm(signum, frame):
+    """Commit the queue journals, then die of the signal: atexit handlers don't run on SIGTERM."""
+    operation_store = sys.modules.get("operation_store")
+    if operation_store is not None:
+        operation_store.close_journals()
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+
+def main(argv=None):
+    global _profiler
+
+    parser = argparse.ArgumentParser(description="Buddy Flask Server")
+    parser.add_argument("--cli", action="store_true", help="Run interactive CLI (Flask only, no MCP)")
+    parser.add_argument("--asgi", action="store_true",
+                        help="Serve HTTP with uvicorn on the MCP event loop instead of the Werkzeug thread (see asgi_server.py)")
+    parser.add_argument("--import-profile", action="store_true",
+                        help="Time every module import and print a startup report on stderr (see startup.py)")
+    args = parser.parse_args(argv)
+    signal.signal(signal.SIGTERM, _on_sigterm)
+
+    if args.import_profile:
+        _profiler = ImportProfiler().install()
+
+    from buddy_logging import setup_logging
+    setup_logging()
+    mark("logging ready")
+
+    if args.cli:
+        # CLI mode: Flask server + interactive CLI (no MCP)
+        _pending.add("http")
+        api = load_http_side(args.asgi)
+        if args.asgi:
+            from asgi_server import start_asgi_thread
+            start_asgi_thread(api.app, api.robots)
+        else:
+            api.start_flask_thread()
+        mark("http started")
+        _done("http")
+        api.run_cli()
+        return
+
+    # Normal mode: MCP server in the main thread (stdio), HTTP side loaded behind it
+    import asyncio
+    from mcp_server import run_server
+    mark("mcp imported")
+    _pending.update(("mcp", "http"))
+
+    if args.asgi:
+        asyncio.run(_serve_mcp_asgi(run_server))
+        return
+
+    # Started only after the handshake so the imports don't compete with it for the GIL
+    start_http = _once(lambda: threading.Thread(target=_start_http_background, name="startup", daemon=True).start())
+
+    def on_listening():
+        _on_mcp_listening()
+        # Also for clients that never send notifications/initialized
+        timer = threading.Timer(HANDSHAKE_GRACE, start_http)
+        timer.daemon = True
+        timer.start()
+
+    def on_initialized():
+        mark("mcp initialized")
+        start_http()
+
+    asyncio.run(run_server(on_listening, on_initialized))
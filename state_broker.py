@@ -0,0 +1,264 @@
+"""
+Cross-process robot state: one owner process, several HTTP worker processes.
+
+The MCP process owns the RobotRegistry (queues, journals, frame caches) and
+stays the single producer of operations. When BUDDY_BROKER_ADDRESS is set
+it also serves that state through a local broker (a multiprocessing
+manager on a Unix socket or host:port). The broker unpickles what it
+receives, so connections must be authenticated: with BUDDY_BROKER_AUTHKEY,
+or for a Unix socket a random key generated at startup and written next to
+the socket (<socket>.key, readable by the owner's user only, like the
+socket). A host:port address is refused without BUDDY_BROKER_AUTHKEY. HTTP workers started with http_workers.py use a
+RemoteRegistry instead of their own RobotRegistry:
+- polls, acks and queue stats are forwarded to the owner's queues, so there
+  is still exactly one copy of each queue (see CHANGELOG_QUEUE_FIX.md)
+- uploaded frames are decoded, resized and encoded by the worker's own image
+  pipeline, on the worker's cores; only the encoded frame is sent to the
+  owner, which publishes it for take_picture, /frames and the MJPEG stream
+- frames and traces only exist in the owner: workers don't serve /frames,
+  /stream.mjpg and /trace (see asgi_server.build_app()), and /robots reads
+  the owner's summaries
+
+Metrics are per process: /metrics on a worker reports that worker's counters
+(plus the owner's queue depths, read through the broker).
+"""
+import asyncio
+import atexit
+import os
+import re
+import secrets
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.managers import BaseManager
+
+from buddy_logging import get_logger
+from image_pipeline import FRAME_HISTORY_SIZE, ImagePipeline
+from robots import DEFAULT_ROBOT_ID, ROBOT_ID_PATTERN, RobotRegistry
+
+# Unix socket path or host:port of the broker (unset = single process)
+BROKER_ADDRESS = os.environ.get("BUDDY_BROKER_ADDRESS")
+# Shared secret of the owner and the workers (unset = generated key file, Unix sockets only)
+BROKER_AUTHKEY = os.environ.get("BUDDY_BROKER_AUTHKEY")
+
+# Set by http_workers.py in the worker processes
+WORKER_ENV = "BUDDY_BROKER_WORKER"
+
+# Threads for blocking broker calls made by the async server (parked long polls)
+POLL_THREADS = int(os.environ.get("BUDDY_BROKER_POLL_THREADS", "64"))
+
+logger = get_logger("state_broker")
+
+
+def parse_address(address: str):
+    """('host', port) for host:port, the path itself for a Unix socket."""
+    match = re.fullmatch(r"([\w.-]+):(\d+)", address)
+    return (match.group(1), int(match.group(2))) if match else address
+
+
+def _key_path(address) -> str:
+    return address + ".key"
+
+
+def _authkey(address, owner: bool) -> bytes:
+    """Authentication key of the broker at `address` (as parsed by parse_address).
+
+    Raises ValueError for a TCP address without BUDDY_BROKER_AUTHKEY.
+    """
+    if BROKER_AUTHKEY:
+        return BROKER_AUTHKEY.encode()
+    if isinstance(address, tuple):
+        raise ValueError("BUDDY_BROKER_AUTHKEY must be set to use the state broker on a host:port address")
+    path = _key_path(address)
+    if not owner:
+        with open(path, "rb") as f:
+            return f.read().strip()
+    key = secrets.token_hex(32).encode()
+    if os.path.exists(path):
+        os.remove(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    atexit.register(lambda: os.path.exists(path) and os.remove(path))
+    return key
+
+
+class BrokerService:
+    """Robot state operations offered to worker processes (runs in the owner process)."""
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def robot_ids(self) -> list:
+        return [robot.id for robot in self.registry]
+
+    def check_robot(self, robot_id, create) -> None:
+        """Raise like RobotRegistry.get() if the robot doesn't exist (and can't be created)."""
+        self.registry.get(robot_id, create)
+
+    def append(self, robot_id, operation, priority, preempt) -> str:
+        return self.registry.get(robot_id).operation_queue.append(operation, priority, preempt)
+
+    def pop(self, robot_id, max_count, wait, lease) -> list:
+        return self.registry.get(robot_id).operation_queue.pop(max_count, wait, lease)
+
+    def ack(self, robot_id, op_id, duration) -> str:
+        # Also completes the trace, which lives in the owner too
+        return self.registry.get(robot_id).operation_queue.ack(op_id, duration)
+
+    def summaries(self) -> list:
+        return self.registry.summaries()
+
+    def release(self, robot_id, op_ids) -> int:
+        return self.registry.get(robot_id).operation_queue.release(op_ids)
+
+    def queue_stats(self, robot_id) -> tuple:
+        """(queued, in flight) of a robot queue."""
+        operation_queue = self.registry.get(robot_id).operation_queue
+        return len(operation_queue), operation_queue.in_flight_count()
+
+    def pending(self, robot_id) -> list:
+        return list(self.registry.get(robot_id).operation_queue)
+
+    def publish_frame(self, robot_id, encoded, mime_type, received_at):
+        self.registry.get(robot_id).image_pipeline.publish_remote_frame(encoded, mime_type, received_at)
+
+    def touch_frame(self, robot_id, received_at):
+        """An unchanged frame: only its timestamp moves."""
+        self.registry.get(robot_id).image_pipeline.touch_remote_frame(received_at)
+
+
+class _BrokerManager(BaseManager):
+    pass
+
+
+# Client side registration; serve_broker() registers the owner's service
+_BrokerManager.register("service")
+
+
+def serve_broker(registry, address: str = BROKER_ADDRESS):
+    """Serve a registry to worker processes from a daemon thread of the owner process.
+
+    Returns the thread, or None when the broker can't be served securely.
+    """
+    service = BrokerService(registry)
+    _BrokerManager.register("service", callable=lambda: service)
+    address = parse_address(address)
+    try:
+        authkey = _authkey(address, owner=True)
+    except (ValueError, OSError) as e:
+        logger.error("State broker not started: %s", e)
+        return None
+    if isinstance(address, str) and os.path.exists(address):
+        os.remove(address)  # stale socket of a previous run
+    server = _BrokerManager(address=address, authkey=authkey).get_server()
+    if isinstance(address, str):
+        os.chmod(address, 0o600)
+    thread = threading.Thread(target=server.serve_forever, name="state-broker", daemon=True)
+    thread.start()
+    logger.info("State broker listening on %s", address)
+    return thread
+
+
+class RemoteOperationQueue:
+    """OperationQueue interface backed by the owner's queue."""
+
+    def __init__(self, service, robot_id: str):
+        self._service = service
+        self.name = robot_id
+
+    def __len__(self):
+        return self._service.queue_stats(self.name)[0]
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        return iter(self._service.pending(self.name))
+
+    def in_flight_count(self) -> int:
+        return self._service.queue_stats(self.name)[1]
+
+    def append(self, operation: dict, priority: str = "normal", preempt: bool = False) -> str:
+        return self._service.append(self.name, operation, priority, preempt)
+
+    def pop(self, max_count=1, wait: float = 0.0, lease: float = None) -> list:
+        return self._service.pop(self.name, max_count, wait, lease)
+
+    async def pop_async(self, max_count=1, wait: float = 0.0, lease: float = None) -> list:
+        # The broker call blocks for up to `wait`: park it on a thread, not on the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_poll_executor, self.pop, max_count, wait, lease)
+
+    def ack(self, op_id: str, duration: float = None) -> str:
+        return self._service.ack(self.name, op_id, duration)
+
+    def release(self, op_ids) -> int:
+        return self._service.release(self.name, list(op_ids))
+
+
+_poll_executor = ThreadPoolExecutor(max_workers=POLL_THREADS, thread_name_prefix="broker-poll")
+
+
+class RemoteRobot:
+    """RobotState of a worker process: remote queue, local image pipeline forwarding to the owner."""
+
+    def __init__(self, service, robot_id: str):
+        self.id = robot_id
+        self.operation_queue = RemoteOperationQueue(service, robot_id)
+        self.lock = threading.Lock()
+        self.latest_image = {"bytes": None, "base64": None, "mime_type": None, "version": 0, "timestamp": None}
+        self.frame_history = deque(maxlen=FRAME_HISTORY_SIZE)
+        # No latest image file: the owner writes it when the frame is forwarded
+        self.image_pipeline = ImagePipeline(
+            robot_id, self.latest_image, self.frame_history, self.lock, image_path=None,
+            on_publish=lambda encoded, mime_type, received_at: service.publish_frame(robot_id, encoded, mime_type,
+                                                                                      received_at),
+            on_touch=lambda received_at: service.touch_frame(robot_id, received_at))
+        self.picture_cache = (None, None)
+
+
+class RemoteRegistry:
+    """RobotRegistry interface of a worker process, connected to the owner's broker."""
+
+    def __init__(self, address: str = BROKER_ADDRESS):
+        parsed = parse_address(address)
+        manager = _BrokerManager(address=parsed, authkey=_authkey(parsed, owner=False))
+        manager.connect()
+        self._service = manager.service()
+        self._robots = {}
+        self._lock = threading.Lock()
+        logger.info("Connected to state broker at %s", address)
+
+    def get(self, robot_id: str = None, create: bool = False) -> RemoteRobot:
+        """Same contract as RobotRegistry.get(); the owner creates the robot and enforces the limit."""
+        robot_id = robot_id or DEFAULT_ROBOT_ID
+        robot = self._robots.get(robot_id)
+        if robot is not None:
+            return robot
+        if not ROBOT_ID_PATTERN.match(robot_id):
+            raise ValueError(f"Invalid robot id: {robot_id!r}")
+        # Raises UnknownRobotError (re-raised here by the manager proxy)
+        self._service.check_robot(robot_id, create)
+        with self._lock:
+            robot = self._robots.get(robot_id)
+            if robot is None:
+                robot = self._robots[robot_id] = RemoteRobot(self._service, robot_id)
+        return robot
+
+    def __iter__(self):
+        return iter([self.get(robot_id) for robot_id in self._service.robot_ids()])
+
+    def summaries(self) -> list:
+        """The owner's robot summaries (frame versions are the owner's, not this worker's)."""
+        return self._service.summaries()
+
+    def __len__(self):
+        return len(self._service.robot_ids())
+
+
+def create_registry():
+    """Robot state of this process: a RemoteRegistry in HTTP workers, the owner's RobotRegistry otherwise."""
+    if os.environ.get(WORKER_ENV):
+        return RemoteRegistry(BROKER_ADDRESS)
+    return RobotRegistry()
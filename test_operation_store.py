@@ -0,0 +1,95 @@
+"""
+Tests of the operation queue (run with `python -m pytest`).
+"""
+import sqlite3
+import time
+
+import operation_store
+from operation_store import OperationQueue, SqliteJournal
+
+
+def move(distance: float, speed: float = 100) -> dict:
+    return {"type": "MoveOperation", "speed": speed, "distance": distance}
+
+
+def test_preempting_stop_cancels_leased_motion():
+    queue = OperationQueue()
+    queue.append(move(5))
+    leased = queue.pop(lease=0.05)
+    assert [op["distance"] for op in leased] == [5]
+
+    queue.append(move(0, speed=0), priority="urgent", preempt=True)
+    assert queue.in_flight_count() == 0
+    assert [op["distance"] for op in queue.pop(None)] == [0]
+
+    # The move's lease has expired by now: it must not come back
+    time.sleep(0.1)
+    assert queue.pop(None, wait=0.1) == []
+    assert queue.ack(leased[0]["id"]) == "cancelled"
+
+
+class FailingOnce:
+    """sqlite3 connection whose first write fails."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.failed = False
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def __enter__(self):
+        return self.conn.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.conn.__exit__(*exc_info)
+
+    def executemany(self, sql, rows):
+        if not self.failed:
+            self.failed = True
+            raise sqlite3.OperationalError("disk I/O error")
+        return self.conn.executemany(sql, rows)
+
+
+def test_failed_journal_write_is_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr(operation_store, "JOURNAL_RETRY_DELAY", 0.01)
+    journal = SqliteJournal(str(tmp_path / "queue.db"))
+    journal._conn = FailingOnce(journal._conn)
+    first = journal.append(move(1))
+    second = journal.append(move(2))
+    journal.remove([second])
+
+    assert journal.flush(timeout=2)
+    assert journal._conn.failed
+    assert [(op_id, op["distance"]) for op_id, op, _ in journal.load()] == [(first, 1)]
+    journal.close()
+
+
+def test_opposite_moves_are_not_compacted_into_a_stop():
+    queue = OperationQueue(compact=True)
+    queue.append(move(5))
+    queue.append(move(-5))
+    assert [op["distance"] for op in queue.pop(None)] == [5, -5]
+    assert queue._tails == {}
+
+
+def test_stop_after_move_is_not_compacted_away():
+    queue = OperationQueue(compact=True)
+    queue.append(move(1))
+    queue.append(move(0))
+    assert [op["distance"] for op in queue.pop(None)] == [1, 0]
+
+    # Also when the move is the last step of a MultiOperation
+    queue.append({"type": "MoodOperation", "mood": "HAPPY"})
+    queue.append(move(1))
+    queue.append(move(0))
+    ops = queue.pop(None)
+    assert [op["type"] for op in ops] == ["MultiOperation", "MoveOperation"]
+    assert ops[0]["operations"][-1]["distance"] == 1 and ops[1]["distance"] == 0
+
+
+def test_append_returns_the_delivered_id():
+    queue = OperationQueue(compact=True)
+    first = queue.append(move(1))
+    assert queue.append(move(2)) == first  # Compacted into the pending move
+    assert [op["id"] for op in queue.pop(None)] == [first]
@@ -0,0 +1,19 @@
+"""
+Tests of the robot registry (run with `python -m pytest`).
+"""
+import pytest
+
+import robots
+from robots import RobotRegistry, UnknownRobotError
+
+
+def test_only_created_on_request_and_up_to_the_limit(monkeypatch):
+    monkeypatch.setattr(robots, "MAX_ROBOTS", 1)
+    registry = RobotRegistry()
+
+    with pytest.raises(UnknownRobotError):
+        registry.get("r1")
+    assert registry.get("r1", create=True) is registry.get("r1")
+    with pytest.raises(UnknownRobotError):
+        registry.get("r2", create=True)
+    assert [robot.id for robot in registry] == [robots.DEFAULT_ROBOT_ID, "r1"]
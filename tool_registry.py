@@ -0,0 +1,99 @@
+"""
+Declarative registry for the MCP tools exposed by Buddy.
+
+Each tool is declared once, next to its implementation in buddy_functions.py,
+with the @register_tool decorator. From that single definition the registry
+builds, once:
+- the mcp Tool object returned by list_tools()
+- a compiled argument parser (JSON schema validation + defaults)
+- the operation builder used by the CLI (build_operation)
+
+The Tool objects and validators are built on first use (or by compile_tools()
+during the startup warm-up), so importing the tools pulls in neither mcp nor
+jsonschema: the CLI never loads them, and the MCP server does not compile
+schemas before answering the handshake.
+"""
+
+
+class ToolSpec:
+    """Everything the server needs to know about one tool."""
+
+    __slots__ = ("name", "description", "input_schema", "handler", "builder", "_tool", "_validator", "_defaults")
+
+    def __init__(self, name, description, input_schema, handler, builder=None):
+        self.name = name
+        self.description = description
+        self.input_schema = input_schema
+        self.handler = handler
+        self.builder = builder
+        self._tool = None
+        self._validator = None
+        self._defaults = {
+            key: prop["default"]
+            for key, prop in input_schema.get("properties", {}).items()
+            if "default" in prop
+        }
+
+    @property
+    def tool(self):
+        """The mcp Tool object, built on first use."""
+        if self._tool is None:
+            from mcp.types import Tool
+            self._tool = Tool(name=self.name, description=self.description, inputSchema=self.input_schema)
+        return self._tool
+
+    def compile(self):
+        """Compile the schema once instead of on every call."""
+        if self._validator is None:
+            from jsonschema.validators import validator_for
+            validator_class = validator_for(self.input_schema)
+            validator_class.check_schema(self.input_schema)
+            self._validator = validator_class(self.input_schema)
+        return self._validator
+
+    def parse(self, arguments: dict) -> dict:
+        """Validate tool arguments and fill in schema defaults.
+
+        Raises ValueError with the first validation error.
+        """
+        arguments = arguments or {}
+        validator = self._validator or self.compile()
+        error = next(validator.iter_errors(arguments), None)
+        if error is not None:
+            location = ".".join(str(part) for part in error.absolute_path)
+            raise ValueError(f"Invalid argument {location}: {error.message}" if location else error.message)
+        return {**self._defaults, **arguments}
+
+
+# name -> ToolSpec, in declaration order
+TOOLS = {}
+_tool_list = None
+
+
+def register_tool(name: str, description: str, input_schema: dict, builder=None):
+    """Decorator registering a function as an MCP tool handler.
+
+    builder, if given, builds the operation dict for this tool from the same
+    keyword arguments as the handler (used by the CLI).
+    """
+    def decorator(handler):
+        global _tool_list
+        TOOLS[name] = ToolSpec(name, description, input_schema, handler, builder)
+        _tool_list = None
+        return handler
+    return decorator
+
+
+def compile_tools():
+    """Build every Tool object and validator ahead of the first call (startup warm-up)."""
+    for spec in TOOLS.values():
+        spec.tool
+        spec.compile()
+
+
+def list_tool_definitions() -> list:
+    """Return the cached list of Tool objects for list_tools()."""
+    global _tool_list
+    if _tool_list is None:
+        _tool_list = [spec.tool for spec in TOOLS.values()]
+    return _tool_list
@@ -0,0 +1,125 @@
+"""
+End-to-end latency traces of operations, from the MCP tool call to the robot.
+
+The operation id doubles as the trace id. Each traced operation records the
+wall-clock time of the stages it went through:
+- received: the MCP server received the tool call
+- enqueued: the operation was appended to the robot queue
+- dequeued: the operation was first handed out by /operation (or the stream)
+- started / completed: reported by the robot through
+  POST /operation/<id>/ack (completed = ack time, started = completed - duration)
+
+The last TRACE_HISTORY traces are kept in memory (BUDDY_TRACE_HISTORY, 0
+disables tracing). /trace/<id> returns one trace and /trace/summary the
+rolling percentiles of each segment over the kept traces, to see whether
+time goes to the MCP side, queueing/polling or the robot.
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict
+
+TRACE_HISTORY = int(os.environ.get("BUDDY_TRACE_HISTORY", "1000"))
+
+# Segments reported in traces and in the summary: name -> (from stage, to stage)
+SEGMENTS = {
+    "mcp_to_queue": ("received", "enqueued"),
+    "queue_wait": ("enqueued", "dequeued"),
+    "robot_pickup": ("dequeued", "started"),
+    "execution": ("started", "completed"),
+    "total": ("received", "completed"),
+}
+PERCENTILES = (50, 90, 99)
+
+_traces = OrderedDict()  # operation id -> trace dict, oldest first
+_lock = threading.Lock()
+
+# (tool name, received time) of the MCP call being handled, if any
+_current_call = contextvars.ContextVar("current_call", default=None)
+
+
+def begin_call(tool: str):
+    """Mark the start of an MCP tool call in the current context.
+
+    Returns a token for end_call().
+    """
+    return _current_call.set((tool, time.time()))
+
+
+def end_call(token):
+    _current_call.reset(token)
+
+
+def record_enqueue(op_id: str, operation: dict, robot: str):
+    """Open the trace of a newly queued operation."""
+    if TRACE_HISTORY <= 0:
+        return
+    trace = {"id": op_id, "type": operation.get("type"), "robot": robot, "tool": None, "enqueued": time.time()}
+    call = _current_call.get()
+    if call is not None:
+        trace["tool"], trace["received"] = call
+    with _lock:
+        _traces[op_id] = trace
+        while len(_traces) > TRACE_HISTORY:
+            _traces.popitem(last=False)
+
+
+def record(op_id: str, stage: str, timestamp: float = None) -> bool:
+    """Record a stage of a traced operation (first occurrence wins).
+
+    Returns False if the operation is not traced (unknown or already evicted).
+    """
+    with _lock:
+        trace = _traces.get(op_id)
+        if trace is None:
+            return False
+        trace.setdefault(stage, timestamp if timestamp is not None else time.time())
+        return True
+
+
+def record_completion(op_id: str, duration: float = None) -> bool:
+    """Record that the robot finished an operation, `duration` seconds after starting it."""
+    now = time.time()
+    if duration is not None and not record(op_id, "started", now - duration):
+        return False
+    return record(op_id, "completed", now)
+
+
+def _segments(trace: dict) -> dict:
+    return {
+        name: trace[end] - trace[start]
+        for name, (start, end) in SEGMENTS.items()
+        if start in trace and end in trace
+    }
+
+
+def get_trace(op_id: str):
+    """A trace with its segment durations (seconds), or None."""
+    with _lock:
+        trace = _traces.get(op_id)
+        trace = dict(trace) if trace is not None else None
+    if trace is None:
+        return None
+    trace["segments"] = _segments(trace)
+    return trace
+
+
+def summary() -> dict:
+    """Count and p50/p90/p99 (seconds) of every segment over the kept traces."""
+    with _lock:
+        traces = [dict(trace) for trace in _traces.values()]
+    durations = {name: [] for name in SEGMENTS}
+    for trace in traces:
+        for name, value in _segments(trace).items():
+            durations[name].append(value)
+
+    result = {"traces": len(traces), "segments": {}}
+    for name, values in durations.items():
+        values.sort()
+        stats = {"count": len(values)}
+        for p in PERCENTILES:
+            # Nearest-rank percentile
+            stats[f"p{p}"] = values[max(0, -(-p * len(values) // 100) - 1)] if values else None
+        result["segments"][name] = stats
+    return result